@@ -9,11 +9,18 @@ User interaction functions (logging and text input)
 """
 
 
-import collections
+import atexit
+import collections.abc
+import copy
 import datetime
+import functools
 import logging
+import logging.handlers
+import queue
+import re
 import sys
 import textwrap
+import time
 
 
 #
@@ -29,9 +36,33 @@ DATE_ORDERS = {
     # Assume US-american date format (m/d, m/d/yy, m/d/yyyy)
     '/': 'mdy'}
 
+# Maximum number of distinct inputs memoized by parse_dates()
+DATE_MEMO_SIZE = 10000
+
+# Box elements precomputed as BoxElements attributes
+BOX_ELEMENT_NAMES = (
+    'horizontal',
+    'vertical',
+    'shoulder',
+    'lower_left_corner',
+    'lower_right_corner')
+
+# First character of a chunk other than spaces in munged text
+RE_NON_SPACE = re.compile('[^ ]')
+
+# Maximum number of rendered headings cached per BoxFormatter
+HEADING_CACHE_SIZE = 1024
+
 DEFAULT_OUTPUT_WIDTH = 85
 DEFAULT_HEADING_INDENT = 3
 
+# Maximum number of queued records in asynchronous output mode
+DEFAULT_QUEUE_SIZE = 10000
+
+# Policies for a full queue in asynchronous output mode
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP = 'drop'
+
 FS_DATE_DE = '%d.%m.%Y'
 FS_DATE_ISO = '%Y-%m-%d'
 
@@ -39,6 +70,7 @@ FS_ATTRIBUTE_ERROR = '{0!r} object has no attribute {1!r}'
 FS_MESSAGE = '%(levelname)-8s\u2551 %(message)s'
 
 MSG_INVALID_ORDER = 'Invalid order {0!r}!'
+MSG_INVALID_OVERFLOW = 'Invalid overflow policy {0!r}!'
 MSG_INVALID_DATE = 'Could not determine a date from {0!r}!'
 
 RC_ERROR = 1
@@ -107,6 +139,84 @@ def date_from_string(date_string, default=None):
     raise ValueError(MSG_INVALID_DATE.format(date_string))
 
 
+@functools.lru_cache(maxsize=None)
+def _date_pattern(separator):
+    """Return a compiled regular expression matching up to three
+    (possibly empty) numeric date components delimited by separator
+    """
+    component = r'\s*([0-9]*)\s*'
+    return re.compile(
+        '{0}{1}{0}(?:{1}{0})?'.format(component, re.escape(separator)))
+
+
+def _order_indexes(order):
+    """Return the (day, month, year) component indexes for order"""
+    if len(order) != 3 or set(order) != set('dmy'):
+        raise ValueError(MSG_INVALID_ORDER.format(order))
+    #
+    return (order.index('d'), order.index('m'), order.index('y'))
+
+
+def parse_dates(iterable, default=None, orders=None):
+    """Generator function yielding a date for each string in iterable,
+    determined like date_from_string() does
+    (orders defaults to DATE_ORDERS).
+    Missing parts are filled from default if a default date object
+    was provided, else from today's date (determined once).
+    Repeated inputs are memoized.
+    Raise a ValueError on the first invalid string.
+    """
+    if not isinstance(default, datetime.date):
+        default = datetime.date.today()
+    #
+    if orders is None:
+        orders = DATE_ORDERS
+    #
+    parsers = [
+        (separator, _date_pattern(separator), _order_indexes(order))
+        for separator, order in orders.items()]
+    fallback_components = (default.day, default.month, default.year)
+    memo = {}
+    for date_string in iterable:
+        try:
+            yield memo[date_string]
+            continue
+        except KeyError:
+            pass
+        #
+        for separator, pattern, indexes in parsers:
+            if separator in date_string:
+                break
+            #
+        else:
+            raise ValueError(MSG_INVALID_DATE.format(date_string))
+        #
+        match = pattern.fullmatch(date_string)
+        if match is None:
+            # Unusual input (e.g. more than three components)
+            parsed_date = date_from_components(
+                date_string.split(separator),
+                order=orders[separator],
+                default=default)
+        else:
+            components = match.groups()
+            day, month, year = (
+                int(components[index]) if components[index]
+                else fallback_components[position]
+                for position, index in enumerate(indexes))
+            if year < 100:
+                year = year + 2000
+            #
+            parsed_date = datetime.date(year, month, day)
+        #
+        if len(memo) >= DATE_MEMO_SIZE:
+            memo.clear()
+        #
+        memo[date_string] = parsed_date
+        yield parsed_date
+    #
+
+
 def formatted_message(msg, *args):
     """Return the message percent-formatted with the arguments.
     Adapted from
@@ -114,7 +224,7 @@ def formatted_message(msg, *args):
     (lines 277-279)
     """
     if args:
-        if (len(args) == 1 and isinstance(args[0], collections.Mapping)
+        if (len(args) == 1 and isinstance(args[0], collections.abc.Mapping)
                 and args[0]):
             args = args[0]
         #
@@ -143,10 +253,172 @@ def wrap_preserving_linebreaks(textwrapper, source_text):
 #
 
 
+class FastTextWrapper(textwrap.TextWrapper):
+
+    """TextWrapper with a fast greedy path for the default options
+    (except width, tab expansion and break_on_hyphens),
+    producing the same output as TextWrapper.
+    Text containing hyphens (if break_on_hyphens is set)
+    and other options are handled by TextWrapper itself.
+    """
+
+    def wrap(self, text):
+        """Return the list of wrapped lines"""
+        if (self.width <= 0
+                or not self.replace_whitespace
+                or self.fix_sentence_endings
+                or not self.break_long_words
+                or not self.drop_whitespace
+                or self.initial_indent
+                or self.subsequent_indent
+                or self.max_lines is not None
+                or (self.break_on_hyphens and '-' in text)):
+            return super().wrap(text)
+        #
+        return list(self.__greedy_lines(text))
+
+    def __greedy_lines(self, text):
+        """Generator function yielding the wrapped lines,
+        mirroring TextWrapper._wrap_chunks() and _handle_long_word()
+        for the supported options.
+        Lines are determined as slices of the munged text, where chunks
+        are runs of spaces or of other characters (as in textwrap
+        without hyphens).
+        """
+        width = self.width
+        text = self._munge_whitespace(text)
+        length = len(text)
+        too_many_spaces = ' ' * (width + 1)
+        offset = 0
+        line_emitted = False
+        while offset < length:
+            if line_emitted:
+                # Drop a whitespace chunk at the beginning of the line
+                if text[offset] == ' ':
+                    match = RE_NON_SPACE.search(text, offset)
+                    offset = length if match is None else match.start()
+                elif text[offset].isspace():
+                    chunk_end = text.find(' ', offset)
+                    if chunk_end < 0:
+                        chunk_end = length
+                    #
+                    if not text[offset:chunk_end].strip():
+                        offset = chunk_end
+                    #
+                #
+                if offset == length:
+                    break
+                #
+            #
+            line_start = offset
+            limit = line_start + width
+            # Greedily add chunks (up to the last chunk boundary
+            # not after limit)
+            if limit >= length:
+                line_end = length
+            elif (text[limit - 1] == ' ') != (text[limit] == ' '):
+                line_end = limit
+            elif text[limit] == ' ':
+                line_end = line_start + len(
+                    text[line_start:limit].rstrip(' '))
+            else:
+                line_end = max(
+                    text.rfind(' ', line_start, limit) + 1, line_start)
+            #
+            offset = line_end
+            if line_end < length and (
+                    text.startswith(too_many_spaces, line_end)
+                    if text[line_end] == ' '
+                    else (line_end + width < length
+                          and text.find(
+                              ' ', line_end, line_end + width + 1) < 0)):
+                # Break a long word, drop the piece if it is whitespace
+                offset = limit
+                if text[line_end:limit].strip():
+                    line_end = limit
+                #
+            elif line_end > line_start and text[line_end - 1].isspace():
+                # Drop the last chunk if it is whitespace
+                if text[line_end - 1] == ' ':
+                    last_chunk_start = line_start + len(
+                        text[line_start:line_end].rstrip(' '))
+                else:
+                    last_chunk_start = max(
+                        text.rfind(' ', line_start, line_end) + 1,
+                        line_start)
+                #
+                if not text[last_chunk_start:line_end].strip():
+                    line_end = last_chunk_start
+                #
+            #
+            if line_end > line_start:
+                yield text[line_start:line_end]
+                line_emitted = True
+            #
+        #
+
+
+class LazyValue:
+
+    """Log message argument evaluated only when the message is formatted:
+    the result of function(*args, **kwargs), computed once and cached
+    """
+
+    def __init__(self, function, *args, **kwargs):
+        """Store the function and its arguments"""
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.__evaluated = False
+        self.__value = None
+
+    @property
+    def value(self):
+        """The (cached) function result"""
+        if not self.__evaluated:
+            self.__value = self.function(*self.args, **self.kwargs)
+            self.__evaluated = True
+        #
+        return self.__value
+
+    def __str__(self):
+        """String representation of the value"""
+        return str(self.value)
+
+    def __repr__(self):
+        """Representation of the value"""
+        return repr(self.value)
+
+    def __format__(self, format_spec):
+        """The value formatted according to format_spec"""
+        return format(self.value, format_spec)
+
+    def __int__(self):
+        """The value as an integer"""
+        return int(self.value)
+
+    def __float__(self):
+        """The value as a float"""
+        return float(self.value)
+
+
 class BoxElements(dict):
 
     """dict-like namespace holding some box drawing elements."""
 
+    def __init__(self, *args, **kwargs):
+        """Initialize the dict and precompute the characters
+        of the BOX_ELEMENT_NAMES elements as attributes
+        """
+        super().__init__(*args, **kwargs)
+        for name in BOX_ELEMENT_NAMES:
+            try:
+                setattr(self, name, self.__getattr__(name))
+            except AttributeError:
+                pass
+            #
+        #
+
     def __getattr__(self, name):
         """Return the character for the codepoint of the name element,
         or default to self['each'] if defined
@@ -210,11 +482,15 @@ class BoxFormatter:
     def __init__(self,
                  full_width=DEFAULT_OUTPUT_WIDTH,
                  heading_indent=DEFAULT_HEADING_INDENT):
-        """Initialize with the given values"""
+        """Initialize with the given values,
+        set up the (bounded) cache of rendered headings
+        """
         self.full_width = full_width
         self.heading_indent = heading_indent
-        self.textwrapper = textwrap.TextWrapper(
+        self.textwrapper = FastTextWrapper(
             width=full_width - 2 * heading_indent - 4)
+        self.__cached_heading = functools.lru_cache(
+            maxsize=HEADING_CACHE_SIZE)(self.__render_heading)
 
     def separator(self, style=None):
         """Return a separator using the requested style"""
@@ -224,27 +500,34 @@ class BoxFormatter:
         return self.styles[style].horizontal * self.full_width
 
     def heading(self, text, style=None):
-        """Return a heading using the requested style"""
+        """Return a heading using the requested style.
+        Repeated headings are returned from the cache.
+        """
         if not text:
             return self.separator(style=style)
         #
         if style is None:
             style = self.light
         #
+        return self.__cached_heading(
+            text, style, self.full_width, self.heading_indent)
+
+    def __render_heading(self, text, style, full_width, heading_indent):
+        """Return a heading using the requested style"""
         selected_style = self.styles[style]
         heading_lines = list(
             wrap_preserving_linebreaks(self.textwrapper, text))
         max_line_length = max(len(line) for line in heading_lines)
         horizontal_frame = selected_style.horizontal * (max_line_length + 2)
-        blank_prefix = ' ' * self.heading_indent
+        blank_prefix = ' ' * heading_indent
         first_line = self.fs_first_line.format(
-            prefix=selected_style.horizontal * self.heading_indent,
+            prefix=selected_style.horizontal * heading_indent,
             overline=horizontal_frame,
             style=selected_style)
         output_lines = [
             '{contents:{style.horizontal}<{width}}'.format(
                 contents=first_line,
-                width=self.full_width,
+                width=full_width,
                 style=selected_style)]
         for line in heading_lines:
             output_lines.append(
@@ -263,6 +546,116 @@ class BoxFormatter:
         return '\n'.join(output_lines)
 
 
+class WrappingFormatter(logging.Formatter):
+
+    """Formatter wrapping the message of a single record,
+    and repeating the prefix from the format on each line.
+    Records with a box_style attribute (see WrappedTextLogger.heading())
+    are rendered as headings or separators.
+    """
+
+    def __init__(self,
+                 fmt=FS_MESSAGE,
+                 datefmt=None,
+                 style='%',
+                 width=DEFAULT_OUTPUT_WIDTH,
+                 heading_indent=DEFAULT_HEADING_INDENT):
+        """Initialize the base class, an internal textwrapper
+        and a box formatter
+        """
+        super().__init__(fmt=fmt, datefmt=datefmt, style=style)
+        self.textwrapper = FastTextWrapper(width=width)
+        self.box_formatter = BoxFormatter(
+            full_width=width,
+            heading_indent=heading_indent)
+
+    def format(self, record):
+        """Format each wrapped line of the message,
+        append exception and stack information like the base class
+        """
+        message = record.getMessage()
+        try:
+            box_style = record.box_style
+        except AttributeError:
+            pass
+        else:
+            message = self.box_formatter.heading(message, style=box_style)
+        #
+        if self.usesTime():
+            record.asctime = self.formatTime(record, self.datefmt)
+        #
+        output_lines = []
+        for line in wrap_preserving_linebreaks(self.textwrapper, message):
+            record.message = line
+            output_lines.append(self.formatMessage(record))
+        #
+        if not output_lines:
+            record.message = message
+            output_lines.append(self.formatMessage(record))
+        #
+        record.message = message
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        #
+        if record.exc_text:
+            output_lines.append(record.exc_text)
+        #
+        if record.stack_info:
+            output_lines.append(self.formatStack(record.stack_info))
+        #
+        return '\n'.join(output_lines)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+
+    """QueueHandler for a bounded queue, leaving formatting
+    to the handlers of the QueueListener.
+    If the queue is full, block or drop the record
+    (and count it) according to the overflow policy.
+    """
+
+    def __init__(self, log_queue, overflow=OVERFLOW_BLOCK):
+        """Initialize the base class and store the overflow policy"""
+        if overflow not in (OVERFLOW_BLOCK, OVERFLOW_DROP):
+            raise ValueError(MSG_INVALID_OVERFLOW.format(overflow))
+        #
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Return a copy of the record with the arguments
+        merged into the message, but not formatted otherwise
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        """Put the record into the queue according to the overflow policy"""
+        if self.overflow == OVERFLOW_BLOCK:
+            self.queue.put(record)
+            return
+        #
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        #
+
+
+class BlockingQueueListener(logging.handlers.QueueListener):
+
+    """QueueListener waiting for free space in a bounded queue
+    when enqueueing the sentinel
+    """
+
+    def enqueue_sentinel(self):
+        """Put the sentinel into the queue, blocking if necessary"""
+        self.queue.put(self._sentinel)
+
+
 class WrappedTextLogger:
 
     """Log wrapped text"""
@@ -270,21 +663,43 @@ class WrappedTextLogger:
     def __init__(self,
                  message_format=FS_MESSAGE,
                  width=DEFAULT_OUTPUT_WIDTH,
-                 heading_indent=DEFAULT_HEADING_INDENT):
-        """Initialize an internal textwrapper"""
-        self.textwrapper = textwrap.TextWrapper(width=width)
+                 heading_indent=DEFAULT_HEADING_INDENT,
+                 single_record=False):
+        """Initialize an internal textwrapper.
+        In single record mode, each message is logged as one record
+        and wrapped by a WrappingFormatter set in configure().
+        """
+        self.textwrapper = FastTextWrapper(width=width)
         self.box_formatter = BoxFormatter(
             full_width=width,
             heading_indent=heading_indent)
         self.message_format = message_format
         self.width = width
+        self.heading_indent = heading_indent
+        self.single_record = single_record
+        self.queue_handler = None
+        self.queue_listener = None
 
     def separator(self, style=None, level=logging.INFO):
         """Log a separator (line) matching the width"""
+        if not logging.root.isEnabledFor(level):
+            return
+        #
+        if self.single_record:
+            logging.log(level, '', extra=dict(box_style=style))
+            return
+        #
         self.log(level, self.box_formatter.separator(style=style))
 
     def heading(self, msg, *args, style=None, level=logging.INFO):
         """Log a heading matching the width"""
+        if not logging.root.isEnabledFor(level):
+            return
+        #
+        if self.single_record:
+            logging.log(level, msg, *args, extra=dict(box_style=style))
+            return
+        #
         text = formatted_message(msg, *args)
         self.log(
             level,
@@ -294,6 +709,13 @@ class WrappedTextLogger:
         """logging.log()
         mixed with self.wrap_preserving_linebreaks()
         """
+        if not logging.root.isEnabledFor(level):
+            return
+        #
+        if self.single_record:
+            logging.log(level, msg, *args)
+            return
+        #
         msg = formatted_message(msg, *args)
         for line in wrap_preserving_linebreaks(self.textwrapper, msg):
             logging.log(level, line)
@@ -351,10 +773,72 @@ class WrappedTextLogger:
         """Exit with an error message unconditionally"""
         self._exit(message, *args, returncode=returncode)
 
-    def configure(self, **kwargs):
-        """Configure logging"""
+    def configure(self,
+                  async_output=False,
+                  queue_size=DEFAULT_QUEUE_SIZE,
+                  overflow=OVERFLOW_BLOCK,
+                  **kwargs):
+        """Configure logging.
+        In single record mode, set a WrappingFormatter
+        on all handlers of the root logger.
+        Asynchronous output implies single record mode:
+        the root logger handlers are moved to a QueueListener thread
+        (doing the wrapping and box rendering), fed through
+        a BoundedQueueHandler with queue_size and overflow
+        (OVERFLOW_BLOCK or OVERFLOW_DROP).
+        Queued records are flushed at exit.
+        """
+        self.stop_async_output()
         kwargs.setdefault('format', self.message_format)
         logging.basicConfig(**kwargs)
+        if async_output:
+            self.single_record = True
+        #
+        if self.single_record:
+            formatter = WrappingFormatter(
+                fmt=kwargs['format'],
+                datefmt=kwargs.get('datefmt'),
+                style=kwargs.get('style', '%'),
+                width=self.width,
+                heading_indent=self.heading_indent)
+            for handler in logging.getLogger().handlers:
+                handler.setFormatter(formatter)
+            #
+        #
+        if async_output:
+            root_logger = logging.getLogger()
+            self.queue_handler = BoundedQueueHandler(
+                queue.Queue(queue_size),
+                overflow=overflow)
+            handlers = root_logger.handlers[:]
+            self.queue_listener = BlockingQueueListener(
+                self.queue_handler.queue,
+                *handlers,
+                respect_handler_level=True)
+            for handler in handlers:
+                root_logger.removeHandler(handler)
+            #
+            root_logger.addHandler(self.queue_handler)
+            self.queue_listener.start()
+            atexit.unregister(self.stop_async_output)
+            atexit.register(self.stop_async_output)
+        #
+
+    def stop_async_output(self):
+        """Stop asynchronous output after processing all queued records,
+        and give the handlers back to the root logger
+        """
+        if self.queue_listener is None:
+            return
+        #
+        root_logger = logging.getLogger()
+        for handler in self.queue_listener.handlers:
+            root_logger.addHandler(handler)
+        #
+        root_logger.removeHandler(self.queue_handler)
+        self.queue_listener.stop()
+        self.queue_handler = None
+        self.queue_listener = None
 
 
 class Interrogator:
@@ -400,7 +884,7 @@ class Interrogator:
         """
         preset_answer = kwargs.pop('preset_answer', None)
         args = list(args)
-        if (len(args) == 1 and isinstance(args[0], collections.Mapping)):
+        if (len(args) == 1 and isinstance(args[0], collections.abc.Mapping)):
             args[0]['preset_answer'] = preset_answer
             placeholder = '%(preset_answer)r'
         else:
@@ -448,20 +932,7 @@ class Interrogator:
         default = kwargs.pop('default', None)
         answer = self.get_input(question_text, *args, **kwargs)
         if answer:
-            for date_format in (FS_DATE_DE, FS_DATE_ISO):
-                try:
-                    answer_datetime = datetime.datetime.strptime(
-                        answer,
-                        date_format)
-                except ValueError:
-                    continue
-                else:
-                    answer_date = answer_datetime.date()
-                    break
-                #
-            else:
-                answer_date = date_from_string(answer, default=default)
-            #
+            answer_date = next(parse_dates((answer,), default=default))
             if isinstance(not_after,
                           datetime.date) and answer_date > not_after:
                 raise ValueError(
@@ -494,4 +965,88 @@ class InterrogatorTranslatedDe(Interrogator):
     msg_no_date = 'Kein Datum angegeben und kein Standardwert!'
 
 
+#
+# Benchmarks
+#
+
+
+def _benchmark_disabled_logging(number=100000):
+    """Measure the cost of disabled debug log calls"""
+    logger = WrappedTextLogger()
+    root_logger = logging.getLogger()
+    previous_level = root_logger.level
+    root_logger.setLevel(logging.INFO)
+    text = ' '.join(['Lorem ipsum dolor sit amet'] * 10)
+    cases = (
+        ('wrapping (cost before checking the level)',
+         lambda: list(
+             wrap_preserving_linebreaks(
+                 logger.textwrapper,
+                 formatted_message('%s: %s', 'text', text)))),
+        ('disabled debug()',
+         lambda: logger.debug('%s: %s', 'text', text)),
+        ('disabled debug() with a LazyValue',
+         lambda: logger.debug(
+             '%s', LazyValue(' '.join, [text] * 100))),
+        ('disabled heading()',
+         lambda: logger.heading('%s', text, level=logging.DEBUG)))
+    try:
+        for name, function in cases:
+            started = time.perf_counter()
+            for _ in range(number):
+                function()
+            #
+            elapsed = time.perf_counter() - started
+            print('{0}: {1:.0f} ns per call'.format(
+                name, elapsed / number * 1e9))
+        #
+    finally:
+        root_logger.setLevel(previous_level)
+    #
+
+
+def _benchmark_headings(number=100000):
+    """Measure rendering repeated headings"""
+    box_formatter = BoxFormatter()
+    texts = ['Section {0}'.format(index) for index in range(10)]
+    started = time.perf_counter()
+    for index in range(number):
+        box_formatter.heading(texts[index % 10], style=BoxFormatter.double)
+    #
+    elapsed = time.perf_counter() - started
+    print('repeated heading(): {0:.0f} ns per call'.format(
+        elapsed / number * 1e9))
+
+
+def _benchmark_wrapping(number_of_lines=20000):
+    """Compare TextWrapper and FastTextWrapper
+    wrapping a multi-MB report
+    """
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur',
+             'adipiscing', 'elit', 'sed', 'do', 'eiusmod', 'tempor']
+    report = '\n'.join(
+        ' '.join(words[(index + offset) % len(words)]
+                 for offset in range(5 + index % 40))
+        for index in range(number_of_lines))
+    results = []
+    for textwrapper in (textwrap.TextWrapper(width=DEFAULT_OUTPUT_WIDTH),
+                        FastTextWrapper(width=DEFAULT_OUTPUT_WIDTH)):
+        started = time.perf_counter()
+        results.append(
+            list(wrap_preserving_linebreaks(textwrapper, report)))
+        elapsed = time.perf_counter() - started
+        print('{0} ({1:.1f} MB): {2:.3f} s'.format(
+            textwrapper.__class__.__name__, len(report) / 1e6, elapsed))
+    #
+    if results[0] != results[1]:
+        print('Results differ!')
+    #
+
+
+if __name__ == '__main__':
+    _benchmark_disabled_logging()
+    _benchmark_headings()
+    _benchmark_wrapping()
+
+
 # vim: fileencoding=utf-8 sw=4 ts=4 sts=4 expandtab autoindent syntax=python:
@@ -9,76 +9,1111 @@ Module providing simplified LDAP helper classes
 """
 
 
+import asyncio
+import base64
+import binascii
+import collections
+import functools
+import io
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+
+#
+# Constants
+#
+
+
+# One attribute type and value pair (RFC 4514 section 3),
+# followed by a separator or the end of the string.
+# Values may be hex strings (#...), quoted strings (RFC 2253)
+# or strings containing escaped characters.
+# Unescaped leading whitespace is not part of the value,
+# unescaped trailing whitespace is removed by parse_dn().
+RE_ATTRIBUTE_TYPE_AND_VALUE = re.compile(
+    r"\s*([A-Za-z][A-Za-z0-9-]*|[0-9]+(?:\.[0-9]+)*)\s*=\s*"
+    r"(#[0-9A-Fa-f]*"
+    r'|"(?:[^"\\]|\\.)*"'
+    r'|(?:[^,;+"\\]|\\.)*)'
+    r"\s*([,;+]|\Z)",
+    re.DOTALL,
+)
+
+RE_ESCAPE_SEQUENCE = re.compile(
+    r"((?:\\[0-9A-Fa-f]{2})+)|\\(.)", re.DOTALL
+)
+
+# Hex string values (BER encoded) are kept as is, including the "#"
+RE_HEX_STRING = re.compile(r"#(?:[0-9A-Fa-f]{2})+")
+
+# Characters to be escaped anywhere in a value
+SPECIAL_CHARACTERS = frozenset('"+,;<>\\')
+
+# Number of DistName objects kept by DistName.from_string()
+INTERN_CACHE_SIZE = 1 << 16
+
+# Number of RelativeDistName objects shared between parsed DNs
+RDN_CACHE_SIZE = 1 << 16
+
+# Maximum LDIF line length before folding (RFC 2849)
+LDIF_FOLD_WIDTH = 76
+
+# Number of characters buffered by LdifWriter before writing
+LDIF_BUFFER_SIZE = 1 << 16
+
+LDIF_MODIFY_OPERATIONS = frozenset(("add", "delete", "replace", "increment"))
+
+# RFC 2849 SAFE-STRING, other values are written base64 encoded
+RE_LDIF_SAFE_STRING = re.compile(
+    r"[\x01-\x09\x0b\x0c\x0e-\x1f\x21-\x39\x3b\x3d-\x7f]"
+    r"[\x01-\x09\x0b\x0c\x0e-\x7f]*"
+)
+
+# EntryCache defaults: maximum number of entries,
+# time to live (seconds) of entries and of negative entries
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 300.0
+DEFAULT_NEGATIVE_TTL = 30.0
+
+LDAP_PORT = 389
+LDAP_VERSION = 3
+
+# Search scopes
+SCOPE_BASE = 0
+SCOPE_ONE_LEVEL = 1
+SCOPE_SUBTREE = 2
+
+DEFAULT_FILTER = "(objectClass=*)"
+DEFAULT_POOL_SIZE = 4
+
+# Attribute types with case-insensitive values (caseIgnoreMatch
+# or caseIgnoreIA5Match) unless overridden in MATCHING_RULES
+CASE_IGNORE_ATTRIBUTE_TYPES = frozenset(
+    (
+        "c",
+        "cn",
+        "dc",
+        "description",
+        "givenname",
+        "l",
+        "mail",
+        "o",
+        "ou",
+        "sn",
+        "st",
+        "street",
+        "title",
+        "uid",
+    )
+)
+
+# Value normalization functions by lowercase attribute type,
+# set through register_matching_rule()
+MATCHING_RULES = {}
+
+MAX_MESSAGE_ID = (1 << 31) - 1
+
+# Simple paged results control (RFC 2696)
+PAGED_RESULTS_OID = b"1.2.840.113556.1.4.319"
+
+# BER tags (universal)
+BER_BOOLEAN = 0x01
+BER_INTEGER = 0x02
+BER_OCTET_STRING = 0x04
+BER_ENUMERATED = 0x0A
+BER_SEQUENCE = 0x30
+BER_SET = 0x31
+
+# BER tags of LDAP protocol operations and other elements (RFC 4511)
+LDAP_BIND_REQUEST = 0x60
+LDAP_BIND_RESPONSE = 0x61
+LDAP_UNBIND_REQUEST = 0x42
+LDAP_SEARCH_REQUEST = 0x63
+LDAP_SEARCH_RESULT_ENTRY = 0x64
+LDAP_SEARCH_RESULT_DONE = 0x65
+LDAP_ABANDON_REQUEST = 0x50
+LDAP_SIMPLE_AUTHENTICATION = 0x80
+LDAP_CONTROLS = 0xA0
+
+# BER tags of search filter elements (RFC 4511 section 4.5.1)
+FILTER_AND = 0xA0
+FILTER_OR = 0xA1
+FILTER_NOT = 0xA2
+FILTER_EQUALITY = 0xA3
+FILTER_SUBSTRINGS = 0xA4
+FILTER_GREATER_OR_EQUAL = 0xA5
+FILTER_LESS_OR_EQUAL = 0xA6
+FILTER_PRESENT = 0x87
+FILTER_APPROXIMATE = 0xA8
+FILTER_EXTENSIBLE = 0xA9
+FILTER_OPERATORS = {
+    "=": FILTER_EQUALITY,
+    ">=": FILTER_GREATER_OR_EQUAL,
+    "<=": FILTER_LESS_OR_EQUAL,
+    "~=": FILTER_APPROXIMATE,
+}
+SUBSTRING_INITIAL = 0x80
+SUBSTRING_ANY = 0x81
+SUBSTRING_FINAL = 0x82
+MATCHING_RULE = 0x81
+MATCHING_TYPE = 0x82
+MATCHING_VALUE = 0x83
+MATCHING_DN_ATTRIBUTES = 0x84
+
+RE_FILTER_ATTRIBUTE = re.compile(r"[A-Za-z0-9][A-Za-z0-9.;-]*")
+RE_FILTER_VALUE = re.compile(r"(?:[^\\]|\\[0-9A-Fa-f]{2})*", re.DOTALL)
+RE_FILTER_ESCAPE = re.compile(rb"\\([0-9A-Fa-f]{2})")
+
+MSG_CONNECTION_CLOSED = "LDAP connection closed"
+MSG_INVALID_BER = "Invalid BER data"
+MSG_INVALID_DN = "Invalid DN {0!r} at position {1}"
+MSG_INVALID_FILTER = "Invalid filter {0!r} at position {1}"
+MSG_INVALID_LDIF = "Invalid LDIF in line {0}: {1!r}"
+MSG_INVALID_RDN = "Invalid RDN {0!r}"
+MSG_NOT_DESCENDANT = "{0!r} is not below {1!r}"
+
+
+#
+# Helper functions
+#
+
+
+def _unescape_match(match):
+    """Return the replacement for an escape sequence"""
+    hex_pairs, character = match.groups()
+    if character is not None:
+        return character
+    #
+    return bytes.fromhex(hex_pairs.replace("\\", "")).decode(
+        "utf-8", errors="replace"
+    )
+
+
+def unescape_value(raw_value):
+    """Return the value from a raw (escaped and possibly quoted)
+    attribute value string
+    """
+    if raw_value.startswith('"'):
+        raw_value = raw_value[1:-1]
+    elif "\\" not in raw_value:
+        return raw_value
+    #
+    return RE_ESCAPE_SEQUENCE.sub(_unescape_match, raw_value)
+
+
+def escape_value(value):
+    """Return value escaped as required by RFC 4514.
+    Hex string values are returned unchanged.
+    """
+    if not value or RE_HEX_STRING.fullmatch(value):
+        return value
+    #
+    escaped = "".join(
+        f"\\{character}"
+        if character in SPECIAL_CHARACTERS
+        else "\\00"
+        if character == "\0"
+        else character
+        for character in value
+    )
+    if escaped[0] in " #":
+        escaped = f"\\{escaped}"
+    #
+    # A single space has already been escaped as a leading space
+    if len(value) > 1 and value[-1] == " ":
+        escaped = f"{escaped[:-1]}\\ "
+    #
+    return escaped
+
+
+def normalize_case_ignore(value):
+    """Return value normalized for case-insensitive comparison,
+    with insignificant whitespace removed
+    """
+    return " ".join(value.split()).casefold()
+
+
+def register_matching_rule(attribute_type, normalize):
+    """Register the normalize function for values of attribute_type.
+    Affects only keys of RDNs and DNs computed afterwards.
+    """
+    MATCHING_RULES[attribute_type.lower()] = normalize
+
+
+def _normalized_value(attribute_type, value):
+    """Return value normalized according to the matching rule
+    of attribute_type (given in lowercase).
+    Values of unknown attribute types are compared exactly.
+    """
+    try:
+        return MATCHING_RULES[attribute_type](value)
+    except KeyError:
+        pass
+    #
+    if attribute_type in CASE_IGNORE_ATTRIBUTE_TYPES:
+        return normalize_case_ignore(value)
+    #
+    return value
+
+
+def _strip_raw_value(raw_value):
+    """Strip trailing whitespace from an unquoted raw value
+    unless it is escaped
+    """
+    stripped = raw_value.rstrip()
+    backslashes = len(stripped) - len(stripped.rstrip("\\"))
+    if backslashes % 2:
+        return raw_value[: len(stripped) + 1]
+    #
+    return stripped
+
+
+def parse_dn(dn_string):
+    """Single-pass tokenizer for RFC 4514 DN strings.
+    Return a list of RDNs, each being a list of
+    (attribute type, value) tuples, the attribute types interned.
+    Raise a ValueError on invalid input.
+    """
+    rdns = []
+    if not dn_string.strip():
+        return rdns
+    #
+    current_rdn = []
+    position = 0
+    length = len(dn_string)
+    while position < length:
+        match = RE_ATTRIBUTE_TYPE_AND_VALUE.match(dn_string, position)
+        if match is None:
+            raise ValueError(MSG_INVALID_DN.format(dn_string, position))
+        #
+        attribute_type, raw_value, separator = match.groups()
+        if raw_value[-1:].isspace():
+            raw_value = _strip_raw_value(raw_value)
+        #
+        current_rdn.append(
+            (sys.intern(attribute_type), unescape_value(raw_value))
+        )
+        if separator != "+":
+            rdns.append(current_rdn)
+            current_rdn = []
+        #
+        position = match.end()
+        if separator and position == length:
+            # Trailing separator
+            raise ValueError(MSG_INVALID_DN.format(dn_string, position))
+        #
+    #
+    return rdns
+
+
+@functools.lru_cache(maxsize=INTERN_CACHE_SIZE)
+def _interned_dist_name(cls, dn_string):
+    """Return a (cached) cls instance parsed from dn_string"""
+    return cls.parse(dn_string)
+
+
+@functools.lru_cache(maxsize=RDN_CACHE_SIZE)
+def _interned_rdn(cls, items):
+    """Return a (cached) cls instance from a tuple of
+    (attribute type, value) tuples
+    """
+    return cls.from_items(items)
+
+
+def _text_or_bytes(value):
+    """Return value (bytes) decoded if it is valid UTF-8,
+    else unchanged
+    """
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value
+    #
+
+
+def bulk_parents(dist_names):
+    """Generator yielding the parent of each DN (None for the root DN).
+    Consecutive siblings share their parent object.
+    """
+    last_parts = last_parent = None
+    for dist_name in dist_names:
+        if not len(dist_name):
+            yield None
+            continue
+        #
+        parts = dist_name[1:]
+        if parts != last_parts:
+            last_parts = parts
+            last_parent = DistName.from_rdns(parts)
+        #
+        yield last_parent
+    #
+
+
+def bulk_is_descendant_of(dist_names, base, strict=False):
+    """Generator yielding True for each DN at or below base
+    (strictly below if strict is True), False otherwise.
+    The suffix comparison is cheap for RDN objects
+    shared with base (e.g. from DistName.parse()).
+    """
+    base_parts = base[:]
+    depth = len(base_parts)
+    minimum_length = depth + 1 if strict else depth
+    for dist_name in dist_names:
+        length = len(dist_name)
+        yield (
+            length >= minimum_length
+            and dist_name[length - depth :] == base_parts
+        )
+    #
+
+
+def bulk_relative_to(dist_names, base):
+    """Generator yielding each DN relative to base,
+    raise a ValueError for a DN not at or below base
+    """
+    base_parts = base[:]
+    depth = len(base_parts)
+    for dist_name in dist_names:
+        length = len(dist_name)
+        if length < depth or dist_name[length - depth :] != base_parts:
+            raise ValueError(MSG_NOT_DESCENDANT.format(dist_name, base))
+        #
+        yield DistName.from_rdns(dist_name[: length - depth])
+    #
+
+
+def bulk_rebase(dist_names, old_base, new_base):
+    """Generator yielding each DN moved from old_base to new_base,
+    sharing the RDN objects of the new suffix.
+    Raise a ValueError for a DN not at or below old_base.
+    """
+    old_parts = old_base[:]
+    depth = len(old_parts)
+    new_suffix = new_base[:]
+    for dist_name in dist_names:
+        length = len(dist_name)
+        if length < depth or dist_name[length - depth :] != old_parts:
+            raise ValueError(MSG_NOT_DESCENDANT.format(dist_name, old_base))
+        #
+        yield DistName.from_rdns(dist_name[: length - depth] + new_suffix)
+    #
+
+
+def _ldif_records(lines):
+    """Generator yielding the records from LDIF lines
+    as lists of (line number, unfolded line) tuples,
+    leaving out comments
+    """
+    record = []
+    start = parts = None
+    comment = False
+    for line_number, line in enumerate(lines, start=1):
+        line = line.rstrip("\r\n")
+        if line.startswith(" "):
+            if parts is None:
+                raise ValueError(MSG_INVALID_LDIF.format(line_number, line))
+            #
+            parts.append(line[1:])
+            continue
+        #
+        if parts is not None and not comment:
+            record.append((start, "".join(parts)))
+        #
+        parts = None
+        if not line:
+            if record:
+                yield record
+                record = []
+            #
+            continue
+        #
+        start, parts, comment = line_number, [line], line.startswith("#")
+    #
+    if parts is not None and not comment:
+        record.append((start, "".join(parts)))
+    #
+    if record:
+        yield record
+    #
+
+
+def _parse_ldif_line(line_number, line):
+    """Return an (attribute description, value) tuple
+    from an unfolded LDIF line.
+    Base64 encoded values are returned as str if they are valid UTF-8,
+    else as bytes. URL references are returned as the URL string.
+    """
+    attribute, separator, value = line.partition(":")
+    if not separator or not attribute:
+        raise ValueError(MSG_INVALID_LDIF.format(line_number, line))
+    #
+    if value.startswith(":"):
+        try:
+            decoded = base64.b64decode(value[1:].strip(), validate=True)
+        except binascii.Error as error:
+            raise ValueError(
+                MSG_INVALID_LDIF.format(line_number, line)
+            ) from error
+        #
+        return attribute, _text_or_bytes(decoded)
+    #
+    if value.startswith("<"):
+        return attribute, value[1:].strip()
+    #
+    return attribute, value.lstrip(" ")
+
+
+def _parse_ldif_modifications(record_lines):
+    """Return a list of LdifModification tuples
+    from an iterator over the remaining lines of a modify record
+    """
+    modifications = []
+    current = None
+    for line_number, line in record_lines:
+        if line == "-":
+            if current is None:
+                raise ValueError(MSG_INVALID_LDIF.format(line_number, line))
+            #
+            modifications.append(current)
+            current = None
+            continue
+        #
+        attribute, value = _parse_ldif_line(line_number, line)
+        if current is None:
+            operation = attribute.lower()
+            if operation not in LDIF_MODIFY_OPERATIONS:
+                raise ValueError(MSG_INVALID_LDIF.format(line_number, line))
+            #
+            current = LdifModification(operation, value, [])
+        elif attribute.lower() == current.attribute_type.lower():
+            current.values.append(value)
+        else:
+            raise ValueError(MSG_INVALID_LDIF.format(line_number, line))
+        #
+    #
+    if current is not None:
+        # Tolerate a missing "-" after the last modification
+        modifications.append(current)
+    #
+    return modifications
+
+
+def read_ldif(lines):
+    """Generator yielding (DistName, attributes) tuples
+    from LDIF lines (e.g. a text file object), one record at a time.
+    attributes is a dict mapping attribute descriptions to lists of values.
+    Change records have a "changetype" entry, modify records
+    a "modifications" entry with a list of LdifModification tuples
+    instead of attribute values.
+    """
+    first_record = True
+    for record in _ldif_records(lines):
+        if first_record:
+            first_record = False
+            attribute, _ = _parse_ldif_line(*record[0])
+            if attribute.lower() == "version":
+                del record[0]
+                if not record:
+                    continue
+                #
+            #
+        #
+        line_number, line = record[0]
+        attribute, dn_string = _parse_ldif_line(line_number, line)
+        if attribute.lower() != "dn" or not isinstance(dn_string, str):
+            raise ValueError(MSG_INVALID_LDIF.format(line_number, line))
+        #
+        attributes = {}
+        record_lines = iter(record[1:])
+        for line_number, line in record_lines:
+            attribute, value = _parse_ldif_line(line_number, line)
+            if attribute.lower() == "changetype":
+                attributes["changetype"] = [value]
+                if value == "modify":
+                    attributes["modifications"] = _parse_ldif_modifications(
+                        record_lines
+                    )
+                #
+                continue
+            #
+            attributes.setdefault(attribute, []).append(value)
+        #
+        yield DistName.parse(dn_string), attributes
+    #
+
+
+def _ldif_line(attribute, value):
+    """Return a (folded) LDIF line including the line break,
+    base64 encoding value if it is not a safe string
+    """
+    if not value:
+        line = f"{attribute}:"
+    elif (
+        isinstance(value, str)
+        and value[-1] != " "
+        and RE_LDIF_SAFE_STRING.fullmatch(value)
+    ):
+        line = f"{attribute}: {value}"
+    else:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        #
+        line = f"{attribute}:: {base64.b64encode(value).decode('ascii')}"
+    #
+    if len(line) > LDIF_FOLD_WIDTH:
+        width = LDIF_FOLD_WIDTH - 1
+        line = "\n ".join(
+            [line[:LDIF_FOLD_WIDTH]]
+            + [
+                line[start : start + width]
+                for start in range(LDIF_FOLD_WIDTH, len(line), width)
+            ]
+        )
+    #
+    return f"{line}\n"
+
+
+def _ber(tag, contents):
+    """Return a BER element"""
+    length = len(contents)
+    if length < 0x80:
+        return bytes((tag, length)) + contents
+    #
+    length_bytes = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes((tag, 0x80 | len(length_bytes))) + length_bytes + contents
+
+
+def _ber_integer(value, tag=BER_INTEGER):
+    """Return a BER encoded integer"""
+    return _ber(
+        tag, value.to_bytes(value.bit_length() // 8 + 1, "big", signed=True)
+    )
+
+
+def _ber_string(value, tag=BER_OCTET_STRING):
+    """Return a BER encoded octet string from str or bytes"""
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    #
+    return _ber(tag, value)
+
+
+def _ber_decode(data, offset=0):
+    """Return a (tag, contents, end offset) tuple
+    for the BER element at offset in data
+    """
+    if offset + 2 > len(data):
+        raise ValueError(MSG_INVALID_BER)
+    #
+    tag, length = data[offset], data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        length_end = offset + (length & 0x7F)
+        length = int.from_bytes(data[offset:length_end], "big")
+        offset = length_end
+    #
+    end = offset + length
+    if end > len(data):
+        raise ValueError(MSG_INVALID_BER)
+    #
+    return tag, data[offset:end], end
+
+
+def _ber_elements(data):
+    """Generator yielding (tag, contents) tuples
+    of the BER elements in data (e.g. the contents of a sequence)
+    """
+    offset = 0
+    while offset < len(data):
+        tag, contents, offset = _ber_decode(data, offset)
+        yield tag, contents
+    #
+
+
+def _ber_decode_integer(contents):
+    """Return the integer from BER integer contents"""
+    return int.from_bytes(contents, "big", signed=True)
+
+
+async def _read_ber_element(reader):
+    """Read one BER element from an asyncio stream reader,
+    return a (tag, contents) tuple
+    """
+    tag, length = await reader.readexactly(2)
+    if length & 0x80:
+        length = int.from_bytes(
+            await reader.readexactly(length & 0x7F), "big"
+        )
+    #
+    return tag, await reader.readexactly(length)
+
+
+def _filter_value(filter_string, start, end):
+    """Return the unescaped value (bytes) from filter_string[start:end]"""
+    value = filter_string[start:end]
+    if not RE_FILTER_VALUE.fullmatch(value):
+        raise ValueError(MSG_INVALID_FILTER.format(filter_string, start))
+    #
+    return RE_FILTER_ESCAPE.sub(
+        lambda match: bytes.fromhex(match.group(1).decode("ascii")),
+        value.encode("utf-8"),
+    )
+
+
+def _encode_filter_item(filter_string, start, end):
+    """Return the BER encoded simple, presence, substrings
+    or extensible match filter from filter_string[start:end]
+    """
+    equals_position = filter_string.find("=", start, end)
+    if equals_position < 0:
+        raise ValueError(MSG_INVALID_FILTER.format(filter_string, start))
+    #
+    operator = "="
+    attribute_end = equals_position
+    if filter_string[equals_position - 1] in "~<>:":
+        operator = filter_string[equals_position - 1 : equals_position + 1]
+        attribute_end -= 1
+    #
+    attribute = filter_string[start:attribute_end]
+    value_start = equals_position + 1
+    if operator == ":=":
+        attribute, *options = attribute.split(":")
+        contents = []
+        if options and options[-1] and options[-1] != "dn":
+            contents.append(_ber_string(options.pop(), MATCHING_RULE))
+        #
+        if attribute:
+            contents.append(_ber_string(attribute, MATCHING_TYPE))
+        #
+        value = _filter_value(filter_string, value_start, end)
+        contents.append(_ber(MATCHING_VALUE, value))
+        if options == ["dn"]:
+            contents.append(_ber(MATCHING_DN_ATTRIBUTES, b"\xff"))
+        elif options or len(contents) < 2:
+            raise ValueError(MSG_INVALID_FILTER.format(filter_string, start))
+        #
+        return _ber(FILTER_EXTENSIBLE, b"".join(contents))
+    #
+    if not RE_FILTER_ATTRIBUTE.fullmatch(attribute):
+        raise ValueError(MSG_INVALID_FILTER.format(filter_string, start))
+    #
+    encoded_attribute = _ber_string(attribute)
+    if operator == "=" and "*" in filter_string[value_start:end]:
+        if value_start + 1 == end:
+            return _ber_string(attribute, FILTER_PRESENT)
+        #
+        substrings = []
+        part_start = value_start
+        while True:
+            part_end = filter_string.find("*", part_start, end)
+            if part_end < 0:
+                part_end = end
+                tag = SUBSTRING_FINAL
+            elif part_start == value_start:
+                tag = SUBSTRING_INITIAL
+            else:
+                tag = SUBSTRING_ANY
+            #
+            if part_end > part_start:
+                value = _filter_value(filter_string, part_start, part_end)
+                substrings.append(_ber(tag, value))
+            #
+            if part_end == end:
+                break
+            #
+            part_start = part_end + 1
+        #
+        return _ber(
+            FILTER_SUBSTRINGS,
+            encoded_attribute + _ber(BER_SEQUENCE, b"".join(substrings)),
+        )
+    #
+    value = _filter_value(filter_string, value_start, end)
+    return _ber(
+        FILTER_OPERATORS[operator],
+        encoded_attribute + _ber(BER_OCTET_STRING, value),
+    )
+
+
+def _encode_filter_at(filter_string, position):
+    """Return a (BER encoded filter, end position) tuple
+    for the parenthesized filter at position in filter_string
+    """
+    if not filter_string.startswith("(", position):
+        raise ValueError(MSG_INVALID_FILTER.format(filter_string, position))
+    #
+    position += 1
+    operator = filter_string[position : position + 1]
+    if operator in ("&", "|"):
+        position += 1
+        elements = []
+        while filter_string.startswith("(", position):
+            element, position = _encode_filter_at(filter_string, position)
+            elements.append(element)
+        #
+        encoded = _ber(
+            FILTER_AND if operator == "&" else FILTER_OR, b"".join(elements)
+        )
+    elif operator == "!":
+        element, position = _encode_filter_at(filter_string, position + 1)
+        encoded = _ber(FILTER_NOT, element)
+    else:
+        end = filter_string.find(")", position)
+        if end < 0:
+            raise ValueError(
+                MSG_INVALID_FILTER.format(filter_string, position)
+            )
+        #
+        encoded = _encode_filter_item(filter_string, position, end)
+        position = end
+    #
+    if not filter_string.startswith(")", position):
+        raise ValueError(MSG_INVALID_FILTER.format(filter_string, position))
+    #
+    return encoded, position + 1
+
+
+def encode_filter(filter_string):
+    """Return the BER encoding of an RFC 4515 search filter string.
+    Raise a ValueError on invalid input.
+    """
+    filter_string = filter_string.strip()
+    if not filter_string.startswith("("):
+        # Tolerate a missing pair of outer parentheses
+        filter_string = f"({filter_string})"
+    #
+    encoded, position = _encode_filter_at(filter_string, 0)
+    if position != len(filter_string):
+        raise ValueError(MSG_INVALID_FILTER.format(filter_string, position))
+    #
+    return encoded
+
+
+def _check_result(contents):
+    """Raise an LdapError if the LDAPResult in contents
+    has a nonzero result code
+    """
+    elements = _ber_elements(contents)
+    result_code = _ber_decode_integer(next(elements)[1])
+    if result_code:
+        matched_dn = next(elements)[1].decode("utf-8")
+        message = next(elements)[1].decode("utf-8", errors="replace")
+        raise LdapError(result_code, matched_dn, message)
+    #
+
+
+def _decode_search_entry(contents):
+    """Return a (DistName, attributes) tuple
+    from the contents of a SearchResultEntry
+    """
+    (_, object_name), (_, attribute_list) = _ber_elements(contents)
+    attributes = {}
+    for _, partial_attribute in _ber_elements(attribute_list):
+        (_, attribute_type), (_, values) = _ber_elements(partial_attribute)
+        attributes[attribute_type.decode("utf-8")] = [
+            _text_or_bytes(value) for _, value in _ber_elements(values)
+        ]
+    #
+    return DistName.parse(object_name.decode("utf-8")), attributes
+
+
+def _paged_results_control(page_size, cookie):
+    """Return the encoded controls with a paged results control"""
+    control_value = _ber(
+        BER_SEQUENCE, _ber_integer(page_size) + _ber_string(cookie)
+    )
+    return _ber(
+        LDAP_CONTROLS,
+        _ber(
+            BER_SEQUENCE,
+            _ber_string(PAGED_RESULTS_OID) + _ber_string(control_value),
+        ),
+    )
+
+
+def _paged_results_cookie(controls):
+    """Return the cookie from the paged results control
+    in the encoded response controls (empty if there is none)
+    """
+    for _, control in _ber_elements(controls):
+        elements = list(_ber_elements(control))
+        if elements[0][1] == PAGED_RESULTS_OID:
+            _, control_value = elements[-1]
+            for _, search_control_value in _ber_elements(control_value):
+                return list(_ber_elements(search_control_value))[1][1]
+            #
+        #
+    #
+    return b""
+
+
+#
+# Classes
+#
+
+
+LdifModification = collections.namedtuple(
+    "LdifModification", ("operation", "attribute_type", "values")
+)
+
+
+@functools.total_ordering
 class RelativeDistName:
 
-    """Object representing an LDAP RDN"""
+    """Object representing an LDAP RDN,
+    storing the attribute(s) as a tuple of
+    (interned attribute type, value) tuples.
+    Equality, hashing and ordering use the normalized key.
+    """
+
+    __slots__ = ("__items", "__string", "__key", "__hash")
 
     def __init__(self, **kwargs):
-        """Store the attribute(s)"""
-        self.__data = kwargs
+        """Store the attribute(s),
+        prepare caching of the string representation, key and hash
+        """
+        self.__items = tuple(
+            (sys.intern(key), value) for key, value in kwargs.items()
+        )
+        self.__string = None
+        self.__key = None
+        self.__hash = None
+
+    @classmethod
+    def from_items(cls, items):
+        """Return a RelativeDN from a tuple of
+        (interned attribute type, value) tuples
+        """
+        rdn = cls.__new__(cls)
+        rdn.__items = items
+        rdn.__string = None
+        rdn.__key = None
+        rdn.__hash = None
+        return rdn
 
     @classmethod
     def from_string(cls, rdn_string):
-        """Return a RelativeDN from rdn_string"""
-        components = {}
-        for part in rdn_string.split("+"):
-            name, value = part.split("=")
-            components[name.strip()] = value.strip()
+        """Return a RelativeDN from rdn_string.
+        Equal RDNs are shared as long as they are held in an LRU cache
+        of RDN_CACHE_SIZE entries.
+        """
+        rdns = parse_dn(rdn_string)
+        if len(rdns) != 1:
+            raise ValueError(MSG_INVALID_RDN.format(rdn_string))
         #
-        return cls(**components)
+        return _interned_rdn(cls, tuple(rdns[0]))
+
+    def items(self):
+        """Return the tuple of (attribute type, value) tuples"""
+        return self.__items
 
     def __getattr__(self, name):
-        """Return the stored attribute"""
-        try:
-            return self.__data[name]
-        except KeyError as error:
-            raise AttributeError(
-                f"{self.__class__.__name__} object has no attribute {name!r}"
-            ) from error
+        """Return the stored attribute.
+        Private names are never looked up (they are unset slots
+        e.g. while unpickling).
+        """
+        if not name.startswith("_"):
+            for key, value in self.__items:
+                if key == name:
+                    return value
+                #
+            #
         #
+        raise AttributeError(
+            f"{self.__class__.__name__} object has no attribute {name!r}"
+        )
+
+    @property
+    def key(self):
+        """(Cached) normalized key: a sorted tuple of
+        (lowercase attribute type, normalized value) tuples
+        """
+        if self.__key is None:
+            normalized_items = []
+            for attribute_type, value in self.__items:
+                attribute_type = sys.intern(attribute_type.lower())
+                normalized_items.append(
+                    (attribute_type, _normalized_value(attribute_type, value))
+                )
+            #
+            self.__key = tuple(sorted(normalized_items))
+        #
+        return self.__key
+
+    def __eq__(self, other):
+        """Compare the keys"""
+        if not isinstance(other, RelativeDistName):
+            return NotImplemented
+        #
+        return self is other or self.key == other.key
+
+    def __lt__(self, other):
+        """Compare the keys"""
+        if not isinstance(other, RelativeDistName):
+            return NotImplemented
+        #
+        return self.key < other.key
 
     def __hash__(self):
-        """Return a hash value"""
-        return hash(str(self))
+        """Return a (cached) hash value"""
+        if self.__hash is None:
+            self.__hash = hash(self.key)
+        #
+        return self.__hash
 
     def __repr__(self):
         """Object representation"""
-        contents = ", ".join(
-            f"{key}={value!r}" for key, value in self.__data.items()
-        )
+        contents = ", ".join(f"{key}={value!r}" for key, value in self.__items)
         return f"{self.__class__.__name__}({contents})"
 
     def __str__(self):
-        """String representation"""
-        return "+".join(f"{key}={value}" for key, value in self.__data.items())
+        """(Cached) string representation"""
+        if self.__string is None:
+            self.__string = "+".join(
+                f"{key}={escape_value(value)}" for key, value in self.__items
+            )
+        #
+        return self.__string
 
 
+@functools.total_ordering
 class DistName:
 
-    """Object representing an LDAP DN"""
+    """Object representing an LDAP DN.
+    Equality, hashing and ordering use the normalized key,
+    so DNs sort root first (parents before their children).
+    """
+
+    __slots__ = ("__parts", "__string", "__key", "__hash")
 
     def __init__(self, *rdns):
         """
         Allocate the inner data structure:
         a tuple of RelativeDistName objects
+        (rdns may be RelativeDistName objects or RDN strings),
+        prepare caching of the string representation, key and hash
         """
         self.__parts = tuple(
-            RelativeDistName.from_string(part) for part in rdns
+            part
+            if isinstance(part, RelativeDistName)
+            else RelativeDistName.from_string(part)
+            for part in rdns
         )
+        self.__string = None
+        self.__key = None
+        self.__hash = None
 
     @classmethod
     def from_string(cls, dn_string):
-        """Return a DN from dn_string"""
-        parts = dn_string.split(",")
-        return cls(*parts)
+        """Return a DN from dn_string.
+        Repeated DN strings return the same (interned) object
+        as long as it is held in an LRU cache
+        of INTERN_CACHE_SIZE entries.
+        """
+        return _interned_dist_name(cls, dn_string)
+
+    @classmethod
+    def from_rdns(cls, rdns):
+        """Return a DN from a tuple of RelativeDistName objects"""
+        dist_name = cls.__new__(cls)
+        dist_name.__parts = rdns
+        dist_name.__string = None
+        dist_name.__key = None
+        dist_name.__hash = None
+        return dist_name
+
+    @classmethod
+    def parse(cls, dn_string):
+        """Return a new DN from dn_string,
+        building the RDNs directly from the tokenizer output.
+        Equal RDNs (e.g. of a common suffix) are shared
+        between DNs as long as they are held in an LRU cache
+        of RDN_CACHE_SIZE entries.
+        """
+        return cls.from_rdns(
+            tuple(
+                _interned_rdn(RelativeDistName, tuple(rdn))
+                for rdn in parse_dn(dn_string)
+            )
+        )
 
     def __getitem__(self, index):
         """Return the part at index"""
         return self.__parts[index]
 
+    def __len__(self):
+        """Return the number of parts"""
+        return len(self.__parts)
+
+    def parent(self):
+        """Return the parent DN, or None for the root DN"""
+        if not self.__parts:
+            return None
+        #
+        return self.from_rdns(self.__parts[1:])
+
+    def is_descendant_of(self, base, strict=False):
+        """Return True if this DN is at or below base
+        (strictly below if strict is True)
+        """
+        length = len(self.__parts)
+        depth = len(base.__parts)
+        if length < depth or strict and length == depth:
+            return False
+        #
+        return self.__parts[length - depth :] == base.__parts
+
+    def relative_to(self, base):
+        """Return the part of this DN below base,
+        raise a ValueError if this DN is not at or below base
+        """
+        if not self.is_descendant_of(base):
+            raise ValueError(MSG_NOT_DESCENDANT.format(self, base))
+        #
+        return self.from_rdns(self.__parts[: len(self.__parts) - len(base)])
+
+    def rebase(self, old_base, new_base):
+        """Return this DN moved from old_base to new_base,
+        raise a ValueError if this DN is not at or below old_base
+        """
+        return self.from_rdns(
+            self.relative_to(old_base).__parts + new_base.__parts
+        )
+
+    @property
+    def key(self):
+        """(Cached) normalized key: a tuple of the RDN keys,
+        root first
+        """
+        if self.__key is None:
+            self.__key = tuple(part.key for part in reversed(self.__parts))
+        #
+        return self.__key
+
+    def __eq__(self, other):
+        """Compare the keys"""
+        if not isinstance(other, DistName):
+            return NotImplemented
+        #
+        return self is other or self.key == other.key
+
+    def __lt__(self, other):
+        """Compare the keys"""
+        if not isinstance(other, DistName):
+            return NotImplemented
+        #
+        return self.key < other.key
+
     def __hash__(self):
-        """Return a hash value"""
-        return hash(str(self))
+        """Return a (cached) hash value"""
+        if self.__hash is None:
+            self.__hash = hash(self.key)
+        #
+        return self.__hash
 
     def __repr__(self):
         """Object representation"""
@@ -86,8 +1121,910 @@ class DistName:
         return f"{self.__class__.__name__}({contents})"
 
     def __str__(self):
-        """String representation"""
-        return ",".join(str(part) for part in self.__parts)
+        """(Cached) string representation"""
+        if self.__string is None:
+            self.__string = ",".join(str(part) for part in self.__parts)
+        #
+        return self.__string
+
+
+class _DNTreeNode:
+
+    """Node of a DNTree"""
+
+    __slots__ = ("children", "dist_name")
+
+    def __init__(self):
+        """Allocate the children dict (by RDN key),
+        and the DN stored in this node (None if unset)
+        """
+        self.children = {}
+        self.dist_name = None
+
+
+class DNTree:
+
+    """Index of DistName objects, stored as a trie
+    keyed by RDN from the root suffix down.
+    Insertion and lookup are O(depth).
+    """
+
+    def __init__(self, dist_names=()):
+        """Allocate the root node and add dist_names"""
+        self.__root = _DNTreeNode()
+        self.__length = 0
+        for dist_name in dist_names:
+            self.add(dist_name)
+        #
+
+    @staticmethod
+    def rdn_key(rdn):
+        """Return the key of rdn in the children dicts"""
+        return rdn.key
+
+    def __path(self, dist_name):
+        """Return the list of nodes from the root
+        as far as they exist along dist_name
+        """
+        rdn_key = self.rdn_key
+        path = [self.__root]
+        node = self.__root
+        for index in range(len(dist_name) - 1, -1, -1):
+            try:
+                node = node.children[rdn_key(dist_name[index])]
+            except KeyError:
+                break
+            #
+            path.append(node)
+        #
+        return path
+
+    def __node(self, dist_name):
+        """Return the node for dist_name or None"""
+        path = self.__path(dist_name)
+        if len(path) == len(dist_name) + 1:
+            return path[-1]
+        #
+        return None
+
+    def add(self, dist_name):
+        """Add dist_name"""
+        rdn_key = self.rdn_key
+        node = self.__root
+        for index in range(len(dist_name) - 1, -1, -1):
+            node = node.children.setdefault(
+                rdn_key(dist_name[index]), _DNTreeNode()
+            )
+        #
+        if node.dist_name is None:
+            self.__length += 1
+        #
+        node.dist_name = dist_name
+
+    def discard(self, dist_name):
+        """Remove dist_name if it is present,
+        and prune nodes without DNs and children
+        """
+        path = self.__path(dist_name)
+        if len(path) < len(dist_name) + 1 or path[-1].dist_name is None:
+            return
+        #
+        path[-1].dist_name = None
+        self.__length -= 1
+        rdn_key = self.rdn_key
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth]
+            if node.children or node.dist_name is not None:
+                break
+            #
+            del path[depth - 1].children[
+                rdn_key(dist_name[len(dist_name) - depth])
+            ]
+        #
+
+    def remove(self, dist_name):
+        """Remove dist_name, raise a KeyError if it is not present"""
+        if dist_name not in self:
+            raise KeyError(dist_name)
+        #
+        self.discard(dist_name)
+
+    def __contains__(self, dist_name):
+        """Return True if dist_name is present"""
+        node = self.__node(dist_name)
+        return node is not None and node.dist_name is not None
+
+    def __len__(self):
+        """Return the number of stored DNs"""
+        return self.__length
+
+    @staticmethod
+    def __iter_nodes(node):
+        """Generator yielding the DNs stored in node and below,
+        parents before their children
+        """
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.dist_name is not None:
+                yield node.dist_name
+            #
+            stack.extend(node.children.values())
+        #
+
+    def __iter__(self):
+        """Return an iterator over all stored DNs"""
+        return self.__iter_nodes(self.__root)
+
+    def subtree(self, base, include_base=True):
+        """Generator yielding all stored DNs below base,
+        including base itself (if stored) if include_base is True
+        """
+        node = self.__node(base)
+        if node is None:
+            return
+        #
+        for dist_name in self.__iter_nodes(node):
+            if include_base or dist_name is not node.dist_name:
+                yield dist_name
+            #
+        #
+
+    def children(self, dist_name):
+        """Generator yielding the stored DNs
+        one level below dist_name
+        """
+        node = self.__node(dist_name)
+        if node is None:
+            return
+        #
+        for child in node.children.values():
+            if child.dist_name is not None:
+                yield child.dist_name
+            #
+        #
+
+    def nearest_ancestor(self, dist_name):
+        """Return the nearest stored DN above dist_name, or None"""
+        path = self.__path(dist_name)[: len(dist_name)]
+        for node in reversed(path):
+            if node.dist_name is not None:
+                return node.dist_name
+            #
+        #
+        return None
+
+
+class LdifWriter:
+
+    """Buffered LDIF writer, usable as a context manager"""
+
+    def __init__(self, stream, buffer_size=LDIF_BUFFER_SIZE, version=True):
+        """Store the stream, write the version line if requested"""
+        self.__stream = stream
+        self.__buffer_size = buffer_size
+        self.__buffer = []
+        self.__buffered = 0
+        if version:
+            self.__append("version: 1\n\n")
+        #
+
+    def __append(self, text):
+        """Append text to the buffer, flush if it is full"""
+        self.__buffer.append(text)
+        self.__buffered += len(text)
+        if self.__buffered >= self.__buffer_size:
+            self.flush()
+        #
+
+    def write(self, dist_name, attributes):
+        """Write one record, attributes being a dict as
+        produced by read_ldif()
+        """
+        lines = [_ldif_line("dn", str(dist_name))]
+        for value in attributes.get("changetype", ()):
+            lines.append(_ldif_line("changetype", value))
+        #
+        for attribute, values in attributes.items():
+            if attribute in ("changetype", "modifications"):
+                continue
+            #
+            for value in values:
+                lines.append(_ldif_line(attribute, value))
+            #
+        #
+        for modification in attributes.get("modifications", ()):
+            lines.append(
+                _ldif_line(modification.operation, modification.attribute_type)
+            )
+            for value in modification.values:
+                lines.append(_ldif_line(modification.attribute_type, value))
+            #
+            lines.append("-\n")
+        #
+        lines.append("\n")
+        self.__append("".join(lines))
+
+    def flush(self):
+        """Write the buffer contents to the stream"""
+        if self.__buffer:
+            self.__stream.write("".join(self.__buffer))
+            self.__buffer.clear()
+            self.__buffered = 0
+        #
+
+    def close(self):
+        """Flush the buffer (the stream is left open)"""
+        self.flush()
+
+    def __enter__(self):
+        """Context manager entry"""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Context manager exit: flush the buffer"""
+        self.close()
+
+
+class _CacheFlight:
+
+    """Load of an EntryCache entry in progress"""
+
+    __slots__ = ("done", "generation", "value", "error")
+
+    def __init__(self, generation):
+        """Allocate the event signalling completion,
+        store the cache generation at start
+        """
+        self.done = threading.Event()
+        self.generation = generation
+        self.value = None
+        self.error = None
+
+
+class EntryCache:
+
+    """Thread-safe cache of directory entries keyed by DistName
+    with LRU eviction, per-entry TTL, negative caching (None values)
+    and single-flight loading
+    """
+
+    def __init__(
+        self,
+        max_size=DEFAULT_CACHE_SIZE,
+        *,
+        ttl=DEFAULT_CACHE_TTL,
+        negative_ttl=DEFAULT_NEGATIVE_TTL,
+    ):
+        """Allocate the internal data structures:
+        an OrderedDict (DN -> (expiry time, value)) in LRU order,
+        a DNTree of the cached DNs for subtree invalidation,
+        and the loads in progress by DN
+        """
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__negative_ttl = negative_ttl
+        self.__entries = collections.OrderedDict()
+        self.__tree = DNTree()
+        self.__flights = {}
+        self.__generation = 0
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__expirations = 0
+
+    def __lookup(self, dist_name):
+        """Return (True, value) for a valid cached entry
+        and count a hit, or (False, None) and count a miss.
+        Must be called with the lock held.
+        """
+        try:
+            expires, value = self.__entries[dist_name]
+        except KeyError:
+            self.__misses += 1
+            return False, None
+        #
+        if expires <= time.monotonic():
+            self.__remove(dist_name)
+            self.__expirations += 1
+            self.__misses += 1
+            return False, None
+        #
+        self.__entries.move_to_end(dist_name)
+        self.__hits += 1
+        return True, value
+
+    def __remove(self, dist_name):
+        """Remove the entry for dist_name.
+        Must be called with the lock held.
+        """
+        del self.__entries[dist_name]
+        self.__tree.discard(dist_name)
+
+    def __store(self, dist_name, value, ttl):
+        """Store value, evicting the least recently used entries.
+        Must be called with the lock held.
+        """
+        if ttl is None:
+            ttl = self.__ttl if value is not None else self.__negative_ttl
+        #
+        if dist_name not in self.__entries:
+            self.__tree.add(dist_name)
+        #
+        self.__entries[dist_name] = (time.monotonic() + ttl, value)
+        self.__entries.move_to_end(dist_name)
+        while len(self.__entries) > self.__max_size:
+            evicted, _ = self.__entries.popitem(last=False)
+            self.__tree.discard(evicted)
+            self.__evictions += 1
+        #
+
+    def get(self, dist_name, default=None):
+        """Return the cached value for dist_name
+        (None for a negative entry), or default
+        """
+        with self.__lock:
+            found, value = self.__lookup(dist_name)
+        #
+        return value if found else default
+
+    def put(self, dist_name, value, ttl=None):
+        """Cache value (None: negative entry) for dist_name,
+        with the default TTL for its kind unless ttl is given
+        """
+        with self.__lock:
+            self.__store(dist_name, value, ttl)
+        #
+
+    def get_or_load(self, dist_name, loader, ttl=None):
+        """Return the cached value for dist_name,
+        or call loader(dist_name) and cache its result
+        (None: not found, cached as a negative entry).
+        Concurrent calls for the same DN wait for a single load
+        and share its result or exception.
+        """
+        with self.__lock:
+            found, value = self.__lookup(dist_name)
+            if found:
+                return value
+            #
+            flight = self.__flights.get(dist_name)
+            leader = flight is None
+            if leader:
+                flight = _CacheFlight(self.__generation)
+                self.__flights[dist_name] = flight
+            #
+        #
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            #
+            return flight.value
+        #
+        try:
+            flight.value = loader(dist_name)
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self.__lock:
+                del self.__flights[dist_name]
+                # Do not cache values loaded before an invalidation
+                if (
+                    flight.error is None
+                    and flight.generation == self.__generation
+                ):
+                    self.__store(dist_name, flight.value, ttl)
+                #
+            #
+            flight.done.set()
+        #
+        return flight.value
+
+    def invalidate(self, dist_name, subtree=False):
+        """Remove the entry for dist_name,
+        and all entries below it if subtree is True
+        """
+        with self.__lock:
+            self.__generation += 1
+            if subtree:
+                for cached_dn in list(self.__tree.subtree(dist_name)):
+                    self.__remove(cached_dn)
+                #
+            elif dist_name in self.__entries:
+                self.__remove(dist_name)
+            #
+        #
+
+    def clear(self):
+        """Remove all entries"""
+        with self.__lock:
+            self.__generation += 1
+            self.__entries.clear()
+            self.__tree = DNTree()
+        #
+
+    def __contains__(self, dist_name):
+        """Return True if a valid entry for dist_name is cached"""
+        with self.__lock:
+            try:
+                expires, _ = self.__entries[dist_name]
+            except KeyError:
+                return False
+            #
+            return expires > time.monotonic()
+        #
+
+    def __len__(self):
+        """Return the number of cached entries (including expired ones
+        that have not been removed yet)
+        """
+        return len(self.__entries)
+
+    def stats(self):
+        """Return a dict with hits, misses, hit ratio,
+        evictions, expirations and the current size
+        """
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return dict(
+                hits=self.__hits,
+                misses=self.__misses,
+                hit_ratio=self.__hits / lookups if lookups else 0.0,
+                evictions=self.__evictions,
+                expirations=self.__expirations,
+                size=len(self.__entries),
+            )
+        #
+
+    def reset_stats(self):
+        """Reset the counters"""
+        with self.__lock:
+            self.__hits = self.__misses = 0
+            self.__evictions = self.__expirations = 0
+        #
+
+
+class LdapError(Exception):
+
+    """LDAP operation result other than success"""
+
+    def __init__(self, result_code, matched_dn="", message=""):
+        """Store the result code, matched DN and diagnostic message"""
+        super().__init__(result_code, matched_dn, message)
+        self.result_code = result_code
+        self.matched_dn = matched_dn
+        self.message = message
+
+    def __str__(self):
+        """Result code and diagnostic message"""
+        return f"LDAP result code {self.result_code}: {self.message}"
+
+
+class LdapConnection:
+
+    """asyncio LDAP connection.
+    Requests are pipelined: any number of them may be outstanding
+    at the same time, responses are dispatched by message ID.
+    """
+
+    def __init__(self, reader, writer):
+        """Store the streams and start reading responses"""
+        self.__reader = reader
+        self.__writer = writer
+        self.__message_id = 0
+        self.__pending = {}
+        self.__closed = False
+        self.__read_task = asyncio.create_task(self.__read_responses())
+
+    @classmethod
+    async def open(
+        cls, host, port=LDAP_PORT, *, ssl=None, bind_dn=None, password=""
+    ):
+        """Return a new connection, bound as bind_dn if given"""
+        reader, writer = await asyncio.open_connection(host, port, ssl=ssl)
+        connection = cls(reader, writer)
+        if bind_dn is not None:
+            try:
+                await connection.bind(bind_dn, password)
+            except BaseException:
+                await connection.close()
+                raise
+            #
+        #
+        return connection
+
+    @property
+    def closed(self):
+        """True if the connection is closed"""
+        return self.__closed
+
+    @property
+    def pending(self):
+        """Number of outstanding requests"""
+        return len(self.__pending)
+
+    async def __read_responses(self):
+        """Dispatch responses to the queues of the pending requests
+        until the connection is closed
+        """
+        failure = ConnectionError(MSG_CONNECTION_CLOSED)
+        try:
+            while True:
+                tag, message = await _read_ber_element(self.__reader)
+                if tag != BER_SEQUENCE:
+                    raise ValueError(MSG_INVALID_BER)
+                #
+                elements = _ber_elements(message)
+                message_id = _ber_decode_integer(next(elements)[1])
+                protocol_tag, protocol_op = next(elements)
+                controls = b""
+                for tag, contents in elements:
+                    if tag == LDAP_CONTROLS:
+                        controls = contents
+                    #
+                #
+                try:
+                    queue = self.__pending[message_id]
+                except KeyError:
+                    # Abandoned request or unsolicited notification
+                    if message_id == 0:
+                        break
+                    #
+                    continue
+                #
+                queue.put_nowait((protocol_tag, protocol_op, controls))
+            #
+        except asyncio.IncompleteReadError:
+            pass
+        except (ConnectionError, ValueError) as error:
+            failure = error
+        finally:
+            self.__closed = True
+            for queue in self.__pending.values():
+                queue.put_nowait(failure)
+            #
+        #
+
+    async def __send(self, protocol_op, controls=b""):
+        """Send a request, return its message ID
+        and the queue receiving the responses
+        """
+        if self.__closed:
+            raise ConnectionError(MSG_CONNECTION_CLOSED)
+        #
+        self.__message_id = self.__message_id % MAX_MESSAGE_ID + 1
+        message_id = self.__message_id
+        queue = asyncio.Queue()
+        self.__pending[message_id] = queue
+        self.__write(message_id, protocol_op, controls)
+        try:
+            await self.__writer.drain()
+        except BaseException:
+            del self.__pending[message_id]
+            raise
+        #
+        return message_id, queue
+
+    def __write(self, message_id, protocol_op, controls=b""):
+        """Write an LDAP message (without waiting)"""
+        self.__writer.write(
+            _ber(
+                BER_SEQUENCE,
+                _ber_integer(message_id) + protocol_op + controls,
+            )
+        )
+
+    @staticmethod
+    async def __receive(queue):
+        """Return the next (tag, contents, controls) tuple
+        from queue, raise a connection failure
+        """
+        response = await queue.get()
+        if isinstance(response, Exception):
+            raise response
+        #
+        return response
+
+    async def bind(self, bind_dn="", password=""):
+        """Simple bind, raise an LdapError on failure"""
+        message_id, queue = await self.__send(
+            _ber(
+                LDAP_BIND_REQUEST,
+                _ber_integer(LDAP_VERSION)
+                + _ber_string(str(bind_dn))
+                + _ber_string(password, LDAP_SIMPLE_AUTHENTICATION),
+            )
+        )
+        try:
+            _, contents, _ = await self.__receive(queue)
+        finally:
+            del self.__pending[message_id]
+        #
+        _check_result(contents)
+
+    async def search(
+        self,
+        base,
+        search_filter=DEFAULT_FILTER,
+        scope=SCOPE_SUBTREE,
+        *,
+        attributes=(),
+        size_limit=0,
+        time_limit=0,
+        page_size=None,
+    ):
+        """Async generator yielding (DistName, attributes) tuples
+        of the search result entries, attributes being a dict
+        of lists of values (str, or bytes if not valid UTF-8).
+        With page_size set, the results are requested page by page
+        using the paged results control.
+        Search result references are ignored.
+        Raise an LdapError if the search fails.
+        """
+        request = _ber(
+            LDAP_SEARCH_REQUEST,
+            b"".join(
+                (
+                    _ber_string(str(base)),
+                    _ber_integer(scope, BER_ENUMERATED),
+                    _ber_integer(0, BER_ENUMERATED),
+                    _ber_integer(size_limit),
+                    _ber_integer(time_limit),
+                    _ber(BER_BOOLEAN, b"\x00"),
+                    encode_filter(search_filter),
+                    _ber(
+                        BER_SEQUENCE,
+                        b"".join(map(_ber_string, attributes)),
+                    ),
+                )
+            ),
+        )
+        cookie = b""
+        while True:
+            controls = b""
+            if page_size is not None:
+                controls = _paged_results_control(page_size, cookie)
+            #
+            message_id, queue = await self.__send(request, controls)
+            done = False
+            try:
+                while not done:
+                    tag, contents, controls = await self.__receive(queue)
+                    if tag == LDAP_SEARCH_RESULT_ENTRY:
+                        yield _decode_search_entry(contents)
+                    elif tag == LDAP_SEARCH_RESULT_DONE:
+                        done = True
+                    #
+                #
+            finally:
+                del self.__pending[message_id]
+                if not done and not self.__closed:
+                    self.__abandon(message_id)
+                #
+            #
+            _check_result(contents)
+            if page_size is None:
+                return
+            #
+            cookie = _paged_results_cookie(controls)
+            if not cookie:
+                return
+            #
+        #
+
+    def __abandon(self, message_id):
+        """Send an abandon request for message_id"""
+        self.__message_id = self.__message_id % MAX_MESSAGE_ID + 1
+        self.__write(
+            self.__message_id, _ber_integer(message_id, LDAP_ABANDON_REQUEST)
+        )
+
+    async def close(self):
+        """Unbind and close the connection"""
+        if not self.__closed:
+            self.__closed = True
+            self.__message_id = self.__message_id % MAX_MESSAGE_ID + 1
+            self.__write(self.__message_id, _ber(LDAP_UNBIND_REQUEST, b""))
+        #
+        self.__writer.close()
+        try:
+            await self.__writer.wait_closed()
+        except ConnectionError:
+            pass
+        #
+        self.__read_task.cancel()
+        await asyncio.gather(self.__read_task, return_exceptions=True)
+
+    async def __aenter__(self):
+        """Async context manager entry"""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Async context manager exit: close the connection"""
+        await self.close()
+
+
+class LdapConnectionPool:
+
+    """Bounded pool of LdapConnection objects.
+    Requests go to the connection with the fewest outstanding requests,
+    a new connection is opened (up to size) only if all are busy.
+    """
+
+    def __init__(
+        self,
+        host,
+        port=LDAP_PORT,
+        *,
+        size=DEFAULT_POOL_SIZE,
+        ssl=None,
+        bind_dn=None,
+        password="",
+    ):
+        """Store the connection parameters"""
+        self.__address = (host, port)
+        self.__options = dict(ssl=ssl, bind_dn=bind_dn, password=password)
+        self.__size = size
+        self.__connections = []
+        self.__lock = None
+
+    async def connection(self):
+        """Return the least busy open connection"""
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        #
+        async with self.__lock:
+            self.__connections = [
+                connection
+                for connection in self.__connections
+                if not connection.closed
+            ]
+            best = min(
+                self.__connections,
+                key=lambda connection: connection.pending,
+                default=None,
+            )
+            if best is None or (
+                best.pending and len(self.__connections) < self.__size
+            ):
+                best = await LdapConnection.open(
+                    *self.__address, **self.__options
+                )
+                self.__connections.append(best)
+            #
+            return best
+        #
+
+    async def search(self, *args, **kwargs):
+        """Async generator: LdapConnection.search()
+        on the least busy connection
+        """
+        connection = await self.connection()
+        async for entry in connection.search(*args, **kwargs):
+            yield entry
+        #
+
+    async def close(self):
+        """Close all connections"""
+        connections, self.__connections = self.__connections, []
+        await asyncio.gather(
+            *(connection.close() for connection in connections)
+        )
+
+    async def __aenter__(self):
+        """Async context manager entry"""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Async context manager exit: close all connections"""
+        await self.close()
+
+
+#
+# Benchmarks
+#
+
+
+def _benchmark_memory(number=100000):
+    """Measure the memory used by number parsed DNs
+    below a common suffix
+    """
+    dn_strings = [
+        f"cn=user{index},ou=group{index % 100},dc=example,dc=com"
+        for index in range(number)
+    ]
+    tracemalloc.start()
+    dist_names = [DistName.parse(dn_string) for dn_string in dn_strings]
+    current_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{len(dist_names)} DNs: {current_size / number:.1f} bytes per DN"
+        f" (string: {sum(map(sys.getsizeof, dn_strings)) / number:.1f}"
+        " bytes per DN)"
+    )
+
+
+def _benchmark_rebase(number=100000):
+    """Compare moving number DNs to a new base
+    by string concatenation and by bulk_rebase()
+    """
+    old_base = DistName.parse("ou=people,dc=example,dc=com")
+    new_base = DistName.parse("ou=staff,ou=people,dc=example,dc=org")
+    dist_names = [
+        DistName.parse(f"cn=user{index},ou=group{index % 100},{old_base}")
+        for index in range(number)
+    ]
+    old_suffix = f",{old_base}"
+    new_suffix = f",{new_base}"
+    for name, function in (
+        (
+            "string concatenation",
+            lambda: [
+                DistName.parse(
+                    str(dist_name)[: -len(old_suffix)] + new_suffix
+                )
+                for dist_name in dist_names
+            ],
+        ),
+        (
+            "bulk_rebase()",
+            lambda: list(bulk_rebase(dist_names, old_base, new_base)),
+        ),
+    ):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        result = function()
+        current_size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{name}: {elapsed:.3f} s,"
+            f" {current_size / len(result):.1f} bytes per DN"
+        )
+    #
+
+
+def _benchmark_ldif(number=100000):
+    """Measure writing and reading number LDIF entries in memory"""
+    entries = [
+        (
+            DistName.parse(
+                f"cn=user{index},ou=group{index % 100},dc=example,dc=com"
+            ),
+            {
+                "objectClass": ["top", "person", "inetOrgPerson"],
+                "cn": [f"user{index}"],
+                "sn": [f"Müller {index}"],
+                "description": [f"Test user number {index} " * 4],
+                "jpegPhoto": [bytes(range(index % 200, index % 200 + 50))],
+            },
+        )
+        for index in range(number)
+    ]
+    stream = io.StringIO()
+    started = time.perf_counter()
+    with LdifWriter(stream) as writer:
+        for dist_name, attributes in entries:
+            writer.write(dist_name, attributes)
+        #
+    #
+    elapsed = time.perf_counter() - started
+    print(f"LDIF write: {number / elapsed:.0f} entries/s")
+    stream.seek(0)
+    started = time.perf_counter()
+    count = sum(1 for _ in read_ldif(stream))
+    elapsed = time.perf_counter() - started
+    print(f"LDIF read:  {count / elapsed:.0f} entries/s")
+
+
+if __name__ == "__main__":
+    _benchmark_memory()
+    _benchmark_rebase()
+    _benchmark_ldif()
 
 
 # vim: fileencoding=utf-8 sw=4 ts=4 sts=4 expandtab autoindent syntax=python:
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+test_simple_ldap
+
+Tests for the asyncio LDAP client in the simple_ldap module,
+using an in-process fake LDAP server
+
+"""
+
+
+import asyncio
+import unittest
+
+import simple_ldap
+
+from simple_ldap import (
+    _ber,
+    _ber_decode_integer,
+    _ber_elements,
+    _ber_integer,
+    _ber_string,
+)
+
+
+#
+# Constants
+#
+
+
+BASE = "dc=example,dc=com"
+PASSWORD = b"secret"
+
+# Search bases answered with an error or a dropped connection
+FAILING_BASE = "cn=fail"
+DROPPING_BASE = "cn=drop"
+
+ENTRIES = [
+    (
+        f"cn=user{index},ou=people,{BASE}",
+        {
+            "cn": [f"user{index}"],
+            "objectClass": ["person"],
+            "photo": [bytes([255, index])],
+        },
+    )
+    for index in range(250)
+]
+
+# Delay (in seconds) before the fake server answers a search
+SEARCH_DELAY = 0.05
+
+
+#
+# Helper functions
+#
+
+
+def _result(tag, result_code=0, message=""):
+    """Return an LDAP result protocol op"""
+    return _ber(
+        tag,
+        _ber_integer(result_code, simple_ldap.BER_ENUMERATED)
+        + _ber_string("")
+        + _ber_string(message),
+    )
+
+
+def _encode_entry(dist_name, attributes):
+    """Return a search result entry protocol op"""
+    return _ber(
+        simple_ldap.LDAP_SEARCH_RESULT_ENTRY,
+        _ber_string(dist_name)
+        + _ber(
+            simple_ldap.BER_SEQUENCE,
+            b"".join(
+                _ber(
+                    simple_ldap.BER_SEQUENCE,
+                    _ber_string(name)
+                    + _ber(
+                        simple_ldap.BER_SET,
+                        b"".join(_ber_string(value) for value in values),
+                    ),
+                )
+                for name, values in attributes.items()
+            ),
+        ),
+    )
+
+
+def _page_request(controls):
+    """Return the page size and the offset (encoded in the cookie)
+    requested by the paged results control in controls,
+    or (None, 0) without the control
+    """
+    for _, control in _ber_elements(controls):
+        elements = list(_ber_elements(control))
+        if elements[0][1] == simple_ldap.PAGED_RESULTS_OID:
+            (_, size), (_, cookie) = _ber_elements(
+                next(_ber_elements(elements[-1][1]))[1]
+            )
+            return _ber_decode_integer(size), int(cookie or b"0")
+        #
+    #
+    return None, 0
+
+
+def _page_response(cookie):
+    """Return the controls of a search result done
+    containing a paged results control with cookie
+    """
+    return _ber(
+        simple_ldap.LDAP_CONTROLS,
+        _ber(
+            simple_ldap.BER_SEQUENCE,
+            _ber_string(simple_ldap.PAGED_RESULTS_OID)
+            + _ber_string(
+                _ber(
+                    simple_ldap.BER_SEQUENCE,
+                    _ber_integer(0) + _ber_string(cookie),
+                )
+            ),
+        ),
+    )
+
+
+#
+# Classes
+#
+
+
+class FakeLdapServer:
+
+    """Minimal in-process LDAP server answering simple binds
+    (with PASSWORD only), searches (returning ENTRIES after SEARCH_DELAY,
+    honouring the paged results control) and abandon requests
+    """
+
+    def __init__(self):
+        """Initialize the counters"""
+        self.server = None
+        self.port = None
+        self.connections = 0
+        self.binds = 0
+        self.unbinds = 0
+        self.abandoned = 0
+        self.active_searches = 0
+        self.max_active_searches = 0
+
+    async def start(self):
+        """Listen on a free port of the loopback interface"""
+        self.server = await asyncio.start_server(
+            self.handle, "127.0.0.1", 0
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening"""
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        """Answer the requests of a connection"""
+        self.connections += 1
+        active = set()
+        tasks = set()
+
+        def send(message_id, protocol_op, controls=b""):
+            """Write a response"""
+            writer.write(
+                _ber(
+                    simple_ldap.BER_SEQUENCE,
+                    _ber_integer(message_id) + protocol_op + controls,
+                )
+            )
+
+        async def search(message_id, protocol_op, controls):
+            """Answer a search request"""
+            active.add(message_id)
+            self.active_searches += 1
+            self.max_active_searches = max(
+                self.max_active_searches, self.active_searches
+            )
+            try:
+                await asyncio.sleep(SEARCH_DELAY)
+                base = next(_ber_elements(protocol_op))[1].decode()
+                if base == FAILING_BASE:
+                    send(
+                        message_id,
+                        _result(
+                            simple_ldap.LDAP_SEARCH_RESULT_DONE,
+                            32,
+                            "no such object",
+                        ),
+                    )
+                    return
+                #
+                page_size, offset = _page_request(controls)
+                if page_size is None:
+                    entries = ENTRIES
+                else:
+                    entries = ENTRIES[offset : offset + page_size]
+                #
+                for dist_name, attributes in entries:
+                    if message_id not in active:
+                        return
+                    #
+                    send(message_id, _encode_entry(dist_name, attributes))
+                    if base == DROPPING_BASE:
+                        writer.transport.abort()
+                        return
+                    #
+                    await asyncio.sleep(0)
+                #
+                response_controls = b""
+                if page_size is not None:
+                    offset += page_size
+                    cookie = b""
+                    if offset < len(ENTRIES):
+                        cookie = str(offset).encode()
+                    #
+                    response_controls = _page_response(cookie)
+                #
+                send(
+                    message_id,
+                    _result(simple_ldap.LDAP_SEARCH_RESULT_DONE),
+                    response_controls,
+                )
+            finally:
+                active.discard(message_id)
+                self.active_searches -= 1
+            #
+
+        try:
+            while True:
+                _, message = await simple_ldap._read_ber_element(reader)
+                elements = list(_ber_elements(message))
+                message_id = _ber_decode_integer(elements[0][1])
+                protocol_tag, protocol_op = elements[1]
+                controls = b""
+                if len(elements) > 2:
+                    controls = elements[2][1]
+                #
+                if protocol_tag == simple_ldap.LDAP_BIND_REQUEST:
+                    self.binds += 1
+                    password = list(_ber_elements(protocol_op))[2][1]
+                    send(
+                        message_id,
+                        _result(
+                            simple_ldap.LDAP_BIND_RESPONSE,
+                            0 if password == PASSWORD else 49,
+                            "invalid credentials",
+                        ),
+                    )
+                elif protocol_tag == simple_ldap.LDAP_SEARCH_REQUEST:
+                    task = asyncio.create_task(
+                        search(message_id, protocol_op, controls)
+                    )
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                elif protocol_tag == simple_ldap.LDAP_ABANDON_REQUEST:
+                    self.abandoned += 1
+                    active.discard(_ber_decode_integer(protocol_op))
+                elif protocol_tag == simple_ldap.LDAP_UNBIND_REQUEST:
+                    self.unbinds += 1
+                    break
+                #
+            #
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            #
+            writer.close()
+        #
+
+
+class EscapeValueTest(unittest.TestCase):
+
+    """escape_value() and unescape_value()"""
+
+    values = (" ", "  ", " a", "a ", " a ", "#a", "a#", "a,b+c", 'x"\\ ')
+
+    def test_round_trip(self):
+        """Escaped values are unescaped to the original"""
+        for value in self.values:
+            with self.subTest(value=value):
+                escaped = simple_ldap.escape_value(value)
+                self.assertEqual(simple_ldap.unescape_value(escaped), value)
+            #
+        #
+
+    def test_dn_round_trip(self):
+        """DNs containing such values survive str() and parsing"""
+        for value in self.values:
+            with self.subTest(value=value):
+                dist_name = simple_ldap.DistName.from_string(
+                    f"cn={simple_ldap.escape_value(value)},dc=example"
+                )
+                self.assertEqual(
+                    simple_ldap.parse_dn(str(dist_name))[0], [("cn", value)]
+                )
+            #
+        #
+
+
+class LdapConnectionTest(unittest.IsolatedAsyncioTestCase):
+
+    """LdapConnection and LdapConnectionPool against FakeLdapServer"""
+
+    async def asyncSetUp(self):
+        """Start the fake server"""
+        self.server = FakeLdapServer()
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        """Stop the fake server"""
+        await self.server.stop()
+
+    async def open(self, **kwargs):
+        """Return a connection to the fake server"""
+        return await simple_ldap.LdapConnection.open(
+            "127.0.0.1", self.server.port, **kwargs
+        )
+
+    async def test_bind(self):
+        """Successful and failing simple binds"""
+        async with await self.open(
+            bind_dn="cn=admin", password="secret"
+        ) as connection:
+            self.assertFalse(connection.closed)
+            self.assertEqual(connection.pending, 0)
+        #
+        with self.assertRaises(simple_ldap.LdapError) as context:
+            await self.open(bind_dn="cn=admin", password="wrong")
+        #
+        self.assertEqual(context.exception.result_code, 49)
+        self.assertEqual(self.server.binds, 2)
+
+    async def test_search(self):
+        """Search results are decoded in order"""
+        async with await self.open() as connection:
+            results = [
+                entry
+                async for entry in connection.search(
+                    BASE, "(objectClass=person)", attributes=["cn"]
+                )
+            ]
+        #
+        self.assertEqual(
+            [str(dist_name) for dist_name, _ in results],
+            [dist_name for dist_name, _ in ENTRIES],
+        )
+        dist_name, attributes = results[1]
+        self.assertIsInstance(dist_name, simple_ldap.DistName)
+        self.assertEqual(attributes["cn"], ["user1"])
+        self.assertEqual(attributes["photo"], [b"\xff\x01"])
+
+    async def test_search_failure(self):
+        """A failing search raises an LdapError"""
+        async with await self.open() as connection:
+            with self.assertRaises(simple_ldap.LdapError) as context:
+                async for _ in connection.search(FAILING_BASE):
+                    pass
+                #
+            #
+            self.assertEqual(context.exception.result_code, 32)
+            self.assertEqual(connection.pending, 0)
+        #
+
+    async def test_paging(self):
+        """Paged searches return all entries"""
+        async with await self.open() as connection:
+            results = [
+                str(dist_name)
+                async for dist_name, _ in connection.search(
+                    BASE, page_size=40
+                )
+            ]
+        #
+        self.assertEqual(results, [dist_name for dist_name, _ in ENTRIES])
+
+    async def test_pipelining(self):
+        """Concurrent searches share a single connection"""
+
+        async def collect(connection):
+            """Return the number of entries found"""
+            return len([entry async for entry in connection.search(BASE)])
+
+        async with await self.open() as connection:
+            counts = await asyncio.gather(
+                *(collect(connection) for _ in range(10))
+            )
+        #
+        self.assertEqual(counts, [len(ENTRIES)] * 10)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.max_active_searches, 10)
+
+    async def test_abandon(self):
+        """Closing a search early sends an abandon request"""
+        async with await self.open() as connection:
+            results = connection.search(BASE)
+            async for _ in results:
+                break
+            #
+            await results.aclose()
+            self.assertEqual(connection.pending, 0)
+            await asyncio.sleep(SEARCH_DELAY)
+            self.assertEqual(self.server.abandoned, 1)
+            # The connection remains usable
+            count = len([entry async for entry in connection.search(BASE)])
+            self.assertEqual(count, len(ENTRIES))
+        #
+
+    async def test_connection_loss(self):
+        """A dropped connection fails pending and new requests"""
+        connection = await self.open()
+        try:
+            with self.assertRaises(ConnectionError):
+                async for _ in connection.search(DROPPING_BASE):
+                    pass
+                #
+            #
+            self.assertTrue(connection.closed)
+            with self.assertRaises(ConnectionError):
+                async for _ in connection.search(BASE):
+                    pass
+                #
+            #
+        finally:
+            await connection.close()
+        #
+
+    async def test_pool(self):
+        """The pool opens no more than size connections"""
+        async with simple_ldap.LdapConnectionPool(
+            "127.0.0.1",
+            self.server.port,
+            size=3,
+            bind_dn="cn=admin",
+            password="secret",
+        ) as pool:
+
+            async def collect():
+                """Return the number of entries found"""
+                return len(
+                    [entry async for entry in pool.search(BASE, page_size=100)]
+                )
+
+            counts = await asyncio.gather(*(collect() for _ in range(12)))
+        #
+        self.assertEqual(counts, [len(ENTRIES)] * 12)
+        self.assertEqual(self.server.connections, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+# vim: fileencoding=utf-8 sw=4 ts=4 sts=4 expandtab autoindent syntax=python:
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+test_translation
+
+Tests for the translation module
+
+"""
+
+
+import copy
+import itertools
+import os
+import pickle
+import re
+import tempfile
+import unittest
+
+import translation
+
+
+ENGINES = (translation.ENGINE_REGEX, translation.ENGINE_AHO_CORASICK)
+
+
+def _chunks(text, chunk_size):
+    """Return text split into chunks of chunk_size"""
+    return [
+        text[start:start + chunk_size]
+        for start in range(0, len(text), chunk_size)]
+
+
+class MatchingTest(unittest.TestCase):
+
+    """Matching in both engines"""
+
+    cases = (
+        ({'a': '1', 'ab': '2', 'abc': '3', 'bcd': '4', 'cd': '5', 'd': '6'},
+         {},
+         'abcdabdbcd',
+         '36264'),
+        ({'he': '1', 'she': '2', 'hers': '3', 'his': '4'},
+         {},
+         'ushers this hershe',
+         'u2rs t4 31'),
+        ({'cat': 'dog', 'Big Cat': 'lion'},
+         dict(whole_words=True, ignore_case=True, preserve_case=True),
+         'Cat concat CAT cat. big cat cats BIG CAT',
+         'Dog concat DOG dog. lion cats LION'),
+        ({'ss': 'S', 'x': 'y'},
+         dict(ignore_case=True),
+         'SsX xsS',
+         'Sy yS'),
+    )
+
+    def test_leftmost_longest(self):
+        """Both engines resolve overlapping keys leftmost-longest"""
+        for replacements, options, text, expected in self.cases:
+            for engine in ENGINES:
+                with self.subTest(text=text, engine=engine):
+                    translator = translation.MultiTranslator(
+                        replacements, engine=engine, **options)
+                    self.assertEqual(translator.engine, engine)
+                    self.assertEqual(translator.translate(text), expected)
+                #
+            #
+        #
+
+    def test_chunk_boundaries(self):
+        """No match is lost at chunk boundaries"""
+        for replacements, options, text, expected in self.cases:
+            for engine in ENGINES:
+                translator = translation.MultiTranslator(
+                    replacements, engine=engine, **options)
+                for chunk_size in (1, 2, 3):
+                    with self.subTest(
+                            text=text, engine=engine, chunk_size=chunk_size):
+                        self.assertEqual(
+                            ''.join(translator.translate_iter(
+                                _chunks(text, chunk_size))),
+                            expected)
+                    #
+                #
+            #
+        #
+
+
+class MutableMappingTest(unittest.TestCase):
+
+    """MultiTranslator changes"""
+
+    def test_iterable_items(self):
+        """Items may be given as an iterator of pairs"""
+        translator = translation.MultiTranslator(
+            zip(['ab', 'c'], ['X', 'Y']), d='Z')
+        self.assertEqual(dict(translator), {'ab': 'X', 'c': 'Y', 'd': 'Z'})
+        self.assertEqual(translator.translate('abcd'), 'XYZ')
+
+    def test_pickle(self):
+        """Instances can be pickled and deep-copied"""
+        translator = translation.MultiTranslator(
+            {'Ab': 'xy', 'c': 'z'}, ignore_case=True, preserve_case=True,
+            engine=translation.ENGINE_AHO_CORASICK, collect_stats=True)
+        for duplicate in (
+                pickle.loads(pickle.dumps(translator)),
+                copy.deepcopy(translator)):
+            self.assertEqual(dict(duplicate), dict(translator))
+            self.assertEqual(
+                duplicate.engine, translation.ENGINE_AHO_CORASICK)
+            self.assertEqual(duplicate.translate('AB ab C'), 'XY xy Z')
+            self.assertEqual(duplicate.stats()['calls'], 1)
+            duplicate['d'] = 'w'
+            self.assertNotIn('d', translator)
+        #
+
+    def test_regex_callback(self):
+        """Instances can be used as re.sub() callbacks"""
+        translator = translation.MultiTranslator(
+            {'Ab': 'xy'}, ignore_case=True, preserve_case=True)
+        self.assertEqual(
+            re.sub('(?i)ab', translator, 'ab AB Ab'), 'xy XY Xy')
+
+    def test_remove_many(self):
+        """Removing several keys at once"""
+        translator = translation.MultiTranslator(
+            {'ab': 'X', 'c': 'Y', 'de': 'Z'})
+        translator.remove_many(['ab', 'c'])
+        self.assertEqual(dict(translator), {'de': 'Z'})
+        self.assertEqual(translator.translate('abcde'), 'abcZ')
+        with self.assertRaises(KeyError):
+            translator.remove_many(['de', 'missing'])
+        #
+        self.assertEqual(dict(translator), {'de': 'Z'})
+
+    def test_clear(self):
+        """Removing all keys"""
+        translator = translation.MultiTranslator({'ab': 'X', 'c': 'Y'})
+        snapshot = translator.compiled
+        translator.clear()
+        self.assertEqual(len(translator), 0)
+        self.assertEqual(translator.translate('abc'), 'abc')
+        self.assertEqual(snapshot.translate('abc'), 'XY')
+
+
+class BytesModeTest(unittest.TestCase):
+
+    """MultiTranslator in bytes mode"""
+
+    def test_bytes_like(self):
+        """bytes-like objects are translated to bytes"""
+        translator = translation.MultiTranslator({b'ab': b'X', b'c': b'Y'})
+        for text_type in (bytes, bytearray, memoryview):
+            text = text_type(b'abcab d')
+            self.assertEqual(translator.translate(text), b'XYX d')
+            self.assertEqual(
+                translator.translate_batch([text, text]), [b'XYX d'] * 2)
+            self.assertEqual(
+                b''.join(translator.translate_iter(
+                    [text_type(b'ca'), text_type(b'bc')])),
+                b'YXY')
+        #
+
+
+class SaveLoadTest(unittest.TestCase):
+
+    """MultiTranslator.save() and .load()"""
+
+    def test_round_trip(self):
+        """A loaded translator translates like the saved one"""
+        translator = translation.MultiTranslator({'ab': 'X', 'c': 'Y'})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'table.bin')
+            translator.save(path)
+            loaded = translation.MultiTranslator.load(path)
+        #
+        self.assertEqual(dict(loaded), dict(translator))
+        self.assertEqual(loaded.translate('abcab'), 'XYX')
+
+    def test_version_mismatch(self):
+        """Files saved by other Python versions are rejected"""
+        translator = translation.MultiTranslator({'ab': 'X'})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'table.bin')
+            translator.save(path)
+            with open(path, mode='r+b') as file_object:
+                file_object.seek(len(translation.FILE_MAGIC) + 1)
+                file_object.write(b'\xff')
+            #
+            with self.assertRaises(ValueError):
+                translation.MultiTranslator.load(path)
+            #
+        #
+
+
+class TranslateManyTest(unittest.TestCase):
+
+    """MultiTranslator.translate_many()"""
+
+    texts = ['ab', 'cab', 'xyz', 'abab'] * 5
+    expected = ['X', 'cX', 'xyz', 'XX'] * 5
+
+    def test_single_process(self):
+        """Translation in the current process"""
+        translator = translation.MultiTranslator({'ab': 'X'})
+        self.assertEqual(
+            list(translator.translate_many(self.texts, chunksize=3)),
+            self.expected)
+
+    def test_workers(self):
+        """Translation in worker processes without statistics"""
+        translator = translation.MultiTranslator({'ab': 'X'})
+        self.assertEqual(
+            list(translator.translate_many(
+                self.texts, workers=2, chunksize=3)),
+            self.expected)
+
+    def test_workers_with_stats(self):
+        """Translation in worker processes collecting statistics"""
+        translator = translation.MultiTranslator(
+            {'ab': 'X'}, collect_stats=True)
+        self.assertEqual(
+            list(translator.translate_many(
+                self.texts, workers=2, chunksize=3)),
+            self.expected)
+        stats = translator.stats()
+        self.assertEqual(stats['hits'], {'ab': 20})
+        self.assertEqual(
+            stats['processed'], sum(len(text) for text in self.texts))
+
+    def test_workers_streaming(self):
+        """Texts are read only as far as needed"""
+        translator = translation.MultiTranslator({'ab': 'X'})
+        read = []
+
+        def texts():
+            """Generator yielding endless texts, recording their number"""
+            for index in itertools.count():
+                read.append(index)
+                yield 'ab'
+            #
+
+        results = translator.translate_many(texts(), workers=2, chunksize=3)
+        self.assertEqual(list(itertools.islice(results, 7)), ['X'] * 7)
+        results.close()
+        # Three batches consumed, up to four more in flight
+        self.assertLessEqual(len(read), 3 * (3 + 2 * 2))
+
+
+class TranslateFileTest(unittest.TestCase):
+
+    """MultiTranslator.translate_file()"""
+
+    def test_line_endings(self):
+        """Line endings are kept and can be matched in text mode"""
+        translator = translation.MultiTranslator({'\r\n': '\n', 'a': 'b'})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'input.txt')
+            out_path = os.path.join(directory, 'output.txt')
+            with open(path, mode='wb') as file_object:
+                file_object.write(b'a\r\nb\rc\r\n')
+            #
+            translator.translate_file(
+                path, out_path, chunk_size=2, encoding='ascii')
+            with open(out_path, mode='rb') as file_object:
+                self.assertEqual(file_object.read(), b'b\nb\rc\n')
+            #
+        #
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# vim: fileencoding=utf-8 sw=4 ts=4 sts=4 expandtab autoindent syntax=python:
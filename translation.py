@@ -9,7 +9,149 @@ Text transl(iter)ation helper classes
 """
 
 
+import collections
+import bisect
+import concurrent.futures
+import itertools
+import marshal
+import mmap
+import os
+import random
 import re
+import string
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+from collections import abc
+
+
+#
+# Constants
+#
+
+
+ENGINE_REGEX = 'regex'
+ENGINE_AHO_CORASICK = 'aho-corasick'
+
+# Tables with more keys than this use the automaton by default
+AUTOMATON_THRESHOLD = 100
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Candidates for separating strings joined in translate_many()
+SEPARATORS = ('\x00', '\x1e', '\x1f', '\ufdd0', '\ufdd1')
+BYTES_SEPARATORS = (b'\x00', b'\x1e', b'\x1f')
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = tuple(10.0 ** exponent for exponent in range(-6, 1))
+
+# Word characters, used for whole-word matching
+WORD_CHARACTER = re.compile(r'\w')
+WORD_BYTE = re.compile(rb'\w')
+
+# Header of files written by MultiTranslator.save(),
+# followed by the Python and marshal format versions
+# as the marshal format is not guaranteed to be portable
+FILE_MAGIC = b'MultiTranslator\x00\x01'
+FILE_HEADER = FILE_MAGIC + bytes(
+    (*sys.version_info[:2], marshal.version))
+
+# Translation tables for higher code points are stored in a dict
+MAX_LIST_TABLE_CODE_POINT = 0xffff
+
+MSG_EMPTY_KEY = 'Empty keys are not supported!'
+MSG_INVALID_FILE = '{0!r} is not a saved MultiTranslator!'
+MSG_MIXED_TYPES = 'Keys and replacements must be either all str or all bytes!'
+MSG_UNKNOWN_ENGINE = 'Unknown matching engine {0!r}!'
+
+
+#
+# Helper functions
+#
+
+
+def _read_chunks(readable, chunk_size):
+    """Generator function yielding chunks read from readable"""
+    while True:
+        chunk = readable.read(chunk_size)
+        if not chunk:
+            break
+        #
+        yield chunk
+    #
+
+
+def _fold_case(text):
+    """Return text lowercased, keeping the length.
+    Characters changing their length when lowercased are kept as is,
+    and final sigma is mapped to sigma as str.lower() depends
+    on the context there.
+    """
+    folded = text.lower()
+    if len(folded) != len(text):
+        folded = ''.join(
+            lowered if len(lowered) == 1 else char
+            for char, lowered in ((char, char.lower()) for char in text))
+    #
+    return folded.replace('\u03c2', '\u03c3')
+
+
+def adapt_case(original, replacement):
+    """Return replacement adapted to the case pattern of original:
+    uppercased if original is uppercase (and longer than one character),
+    capitalized if original starts uppercase, else unchanged.
+    """
+    if len(original) > 1 and original.isupper():
+        return replacement.upper()
+    #
+    if original[:1].isupper():
+        return replacement[:1].upper() + replacement[1:]
+    #
+    return replacement
+
+
+def _batches(iterable, batch_size):
+    """Generator function yielding lists of up to batch_size items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            break
+        #
+        yield batch
+    #
+
+
+# Translator of the current worker process in translate_many(),
+# set once per worker by _initialize_worker()
+_worker_translator = None
+
+
+def _initialize_worker(translator):
+    """Store the translator (a CompiledTable) in the worker process"""
+    global _worker_translator  # pylint: disable=global-statement
+    _worker_translator = translator
+
+
+def _translate_batch_in_worker(batch, collect_stats=False):
+    """Translate a batch using the worker's translator.
+    Return a tuple of the translated batch, a Counter of hits
+    if collect_stats is True (else None), and the processed length.
+    """
+    processed = sum(len(text) for text in batch)
+    if not collect_stats:
+        return _worker_translator.translate_batch(batch), None, processed
+    #
+    hits = collections.Counter()
+    return (
+        _worker_translator.translate_batch(batch, hits=hits),
+        hits,
+        processed)
 
 
 #
@@ -17,30 +159,1400 @@ import re
 #
 
 
-class MultiTranslator:
+class RegexMatcher:
+
+    """Matcher using a catch-all regular expression.
+    The keys are sorted by descending length,
+    so the alternation produces leftmost-longest matches.
+    If whole_words is True, matches must neither be preceded
+    nor followed by a word character.
+    """
+
+    def __init__(self, keys, whole_words=False):
+        """Precompile the catch-all regular expression
+        (from str or bytes keys)
+        """
+        keys = sorted(keys, key=len, reverse=True)
+        if isinstance(keys[0], bytes):
+            pattern = b'|'.join(re.escape(key) for key in keys)
+            if whole_words:
+                pattern = rb'(?<!\w)(?:%s)(?!\w)' % pattern
+            #
+        else:
+            pattern = '|'.join(re.escape(key) for key in keys)
+            if whole_words:
+                pattern = rf'(?<!\w)(?:{pattern})(?!\w)'
+            #
+        #
+        self.__catch_all = re.compile(pattern)
+
+    def spans(self, text, pos=0):
+        """Generator yielding (start, end) tuples
+        of all non-overlapping matches in text, beginning at pos
+        """
+        for match in self.__catch_all.finditer(text, pos):
+            yield match.span()
+        #
+
+
+class AhoCorasickMatcher:
+
+    """Aho–Corasick automaton producing leftmost-longest matches.
+    Matching time is independent of the number of keys
+    and linear in the text length (times the maximum key length
+    in the worst case, where a started match has to be rescanned).
+    If whole_words is True, matches must neither be preceded
+    nor followed by a word character.
+    """
+
+    def __init__(self, keys, whole_words=False):
+        """Build the trie, then add the failure links"""
+        self.__whole_words = whole_words
+        self.__transitions = [{}]
+        self.__depths = [0]
+        self.__outputs = [0]
+        for key in keys:
+            state = 0
+            for char in key:
+                try:
+                    state = self.__transitions[state][char]
+                except KeyError:
+                    self.__transitions.append({})
+                    self.__depths.append(self.__depths[state] + 1)
+                    self.__outputs.append(0)
+                    new_state = len(self.__transitions) - 1
+                    self.__transitions[state][char] = new_state
+                    state = new_state
+                #
+            #
+            self.__outputs[state] = len(key)
+        #
+        self.__key_lengths = list(self.__outputs)
+        self.__failures = [0] * len(self.__transitions)
+        self.__dict_links = [0] * len(self.__transitions)
+        self.__add_failure_links()
+
+    def __add_failure_links(self):
+        """Add failure links, the length of the longest key
+        ending in each state, and links to the next shorter key
+        ending in each state, in breadth-first order
+        """
+        queue = collections.deque(self.__transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.__transitions[state].items():
+                queue.append(next_state)
+                fallback = self.__failures[state]
+                while fallback and char not in self.__transitions[fallback]:
+                    fallback = self.__failures[fallback]
+                #
+                failure = self.__transitions[fallback].get(char, 0)
+                self.__failures[next_state] = failure
+                if self.__key_lengths[failure]:
+                    self.__dict_links[next_state] = failure
+                else:
+                    self.__dict_links[next_state] = self.__dict_links[failure]
+                #
+                if not self.__outputs[next_state]:
+                    self.__outputs[next_state] = self.__outputs[
+                        self.__failures[next_state]]
+                #
+            #
+        #
+
+    @classmethod
+    def from_tables(cls, tables):
+        """Return an instance from the tables
+        returned by the .tables() method
+        """
+        matcher = cls.__new__(cls)
+        (matcher.__transitions,
+         matcher.__failures,
+         matcher.__depths,
+         matcher.__outputs,
+         matcher.__key_lengths,
+         matcher.__dict_links,
+         matcher.__whole_words) = tables
+        return matcher
+
+    def tables(self):
+        """Return the internal tables as a tuple of lists
+        and the whole_words flag
+        """
+        return (
+            self.__transitions,
+            self.__failures,
+            self.__depths,
+            self.__outputs,
+            self.__key_lengths,
+            self.__dict_links,
+            self.__whole_words)
+
+    def __longest_whole_word(self, text, state, end):
+        """Return the length of the longest key ending in state
+        that is a whole word in text, or 0
+        """
+        word_character = WORD_BYTE if isinstance(text, bytes) \
+            else WORD_CHARACTER
+        if word_character.match(text, end):
+            return 0
+        #
+        if not self.__key_lengths[state]:
+            state = self.__dict_links[state]
+        #
+        while state:
+            start = end - self.__key_lengths[state]
+            if not start or not word_character.match(text, start - 1):
+                return self.__key_lengths[state]
+            #
+            state = self.__dict_links[state]
+        #
+        return 0
+
+    def spans(self, text, pos=0):
+        """Generator yielding (start, end) tuples
+        of all non-overlapping matches in text, beginning at pos
+        """
+        transitions = self.__transitions
+        failures = self.__failures
+        depths = self.__depths
+        outputs = self.__outputs
+        text_length = len(text)
+        while pos < text_length:
+            state = 0
+            best_start = best_end = -1
+            index = pos
+            while index < text_length:
+                char = text[index]
+                while state and char not in transitions[state]:
+                    state = failures[state]
+                #
+                state = transitions[state].get(char, 0)
+                index += 1
+                if best_end >= 0 and index - depths[state] > best_start:
+                    # No match starting at or before best_start
+                    # can be found anymore
+                    break
+                #
+                length = outputs[state]
+                if length and self.__whole_words:
+                    length = self.__longest_whole_word(text, state, index)
+                #
+                if length and (best_end < 0 or index - length <= best_start):
+                    best_start = index - length
+                    best_end = index
+                #
+            #
+            if best_end < 0:
+                return
+            #
+            yield best_start, best_end
+            pos = best_end
+        #
+
+
+class CompiledTable:
+
+    """Immutable snapshot of a translation table
+    compiled for matching, used by MultiTranslator.
+    Single-character keys are handled by str.translate()
+    (in bytes mode: single bytes replaced by at most one byte
+    are handled by bytes.translate()),
+    only the remaining keys are passed to the matching engine.
+
+    If ignore_case is True, keys are matched case-insensitively
+    against a lowercased copy of the text.
+    If whole_words is True, keys only match as whole words,
+    and all keys are passed to the matching engine.
+    If preserve_case is True, replacements are adapted
+    to the case pattern of the matched text (see adapt_case()).
+    """
+
+    engines = {
+        ENGINE_REGEX: RegexMatcher,
+        ENGINE_AHO_CORASICK: AhoCorasickMatcher}
+
+    def __init__(self, replacements, engine=None, previous=None,
+                 ignore_case=False, whole_words=False, preserve_case=False):
+        """Compile the replacements dict (which must not be changed
+        afterwards) for the requested engine.
+        The matcher of the previous CompiledTable is reused
+        if it was built for the same engine and the same keys.
+        """
+        self.replacements = replacements
+        self.bytes_mode = any(
+            isinstance(key, bytes) for key in replacements)
+        self.empty = b'' if self.bytes_mode else ''
+        self.ignore_case = ignore_case
+        self.whole_words = whole_words
+        self.preserve_case = preserve_case
+        self.lookup = self.__build_lookup()
+        single_characters = {}
+        multi_character_keys = []
+        for key, replacement in self.lookup.items():
+            if len(key) == 1 and not whole_words \
+                    and (not self.bytes_mode or len(replacement) < 2):
+                single_characters[key] = replacement
+            else:
+                multi_character_keys.append(key)
+            #
+        #
+        single_characters = self.__case_variants(single_characters)
+        # Keys of the translation table, counted for the statistics
+        self.table_keys = tuple(single_characters)
+        if not single_characters:
+            self.table_args = None
+        elif self.bytes_mode:
+            self.table_args = self.__compile_bytes_table(single_characters)
+        else:
+            self.table_args = (
+                self.__compile_char_table(single_characters),)
+        #
+        if engine is None:
+            if len(multi_character_keys) > AUTOMATON_THRESHOLD:
+                engine = ENGINE_AHO_CORASICK
+            else:
+                engine = ENGINE_REGEX
+            #
+        #
+        try:
+            matcher_class = self.engines[engine]
+        except KeyError as error:
+            raise ValueError(MSG_UNKNOWN_ENGINE.format(engine)) from error
+        #
+        self.engine = engine
+        self.matcher_keys = frozenset(multi_character_keys)
+        if not multi_character_keys:
+            self.matcher = None
+        elif previous is not None \
+                and previous.engine == engine \
+                and previous.whole_words == whole_words \
+                and previous.matcher_keys == self.matcher_keys:
+            self.matcher = previous.matcher
+        else:
+            self.matcher = matcher_class(
+                multi_character_keys, whole_words=whole_words)
+        #
+        # Number of characters that have to be known
+        # beyond a match start before the match is final,
+        # and before a match start in whole-word mode
+        self.lookahead = max(
+            (len(key) - 1 for key in multi_character_keys), default=0)
+        self.context = 0
+        if whole_words:
+            self.lookahead += 1
+            self.context = 1
+        #
+        # A separator must not be part of any key, so no match
+        # can span two joined strings, nor of any replacement
+        self.separator = None
+        for separator in (
+                BYTES_SEPARATORS if self.bytes_mode else SEPARATORS):
+            if not any(separator in key or separator in replacement
+                       for key, replacement in replacements.items()):
+                self.separator = separator
+                break
+            #
+        #
+
+    def __build_lookup(self):
+        """Return a dict of the replacements by matchable keys"""
+        if not self.ignore_case:
+            return self.replacements
+        #
+        return {
+            self.fold(key): replacement
+            for key, replacement in self.replacements.items()}
+
+    def __case_variants(self, single_characters):
+        """Return single_characters including the case variants
+        of each key if ignore_case is True,
+        with replacements adapted to their case if preserve_case is True
+        """
+        variants = {}
+        for key, replacement in single_characters.items():
+            if self.ignore_case:
+                keys = (key, key.upper())
+            else:
+                keys = (key,)
+            #
+            for variant in keys:
+                if len(variant) != 1 or variant in variants:
+                    continue
+                #
+                if self.preserve_case:
+                    variants[variant] = adapt_case(variant, replacement)
+                else:
+                    variants[variant] = replacement
+                #
+            #
+        #
+        return variants
+
+    @classmethod
+    def from_state(cls, state):
+        """Return an instance from a dict returned by .state()"""
+        compiled = cls.__new__(cls)
+        compiled.__dict__.update(state)
+        compiled.lookup = compiled.__build_lookup()
+        compiled.matcher_keys = frozenset(compiled.matcher_keys)
+        compiled.table_keys = tuple(compiled.table_keys)
+        if compiled.matcher is not None:
+            compiled.matcher = AhoCorasickMatcher.from_tables(
+                compiled.matcher)
+        #
+        return compiled
+
+    def state(self):
+        """Return the state as a dict of builtin types only.
+        The matcher is stored as automaton tables,
+        so a regex matcher is converted to an automaton.
+        """
+        state = dict(vars(self))
+        del state['lookup']
+        state['matcher_keys'] = list(self.matcher_keys)
+        state['table_keys'] = list(self.table_keys)
+        if self.matcher is not None:
+            if self.engine == ENGINE_AHO_CORASICK:
+                matcher = self.matcher
+            else:
+                matcher = AhoCorasickMatcher(
+                    self.matcher_keys, whole_words=self.whole_words)
+                state['engine'] = ENGINE_AHO_CORASICK
+            #
+            state['matcher'] = matcher.tables()
+        #
+        return state
+
+    def fold(self, text):
+        """Return text lowercased, keeping the length"""
+        if self.bytes_mode:
+            return text.lower()
+        #
+        return _fold_case(text)
+
+    @staticmethod
+    def __compile_char_table(single_characters):
+        """Return a translation table for str.translate().
+        A list indexed by code point is used in favor of the dict
+        returned by str.maketrans() because str.translate()
+        handles a missing dict key through a (slow) LookupError.
+        """
+        max_code_point = max(ord(key) for key in single_characters)
+        if max_code_point > MAX_LIST_TABLE_CODE_POINT:
+            return str.maketrans(single_characters)
+        #
+        char_table = [
+            chr(code_point)
+            for code_point in range(max(max_code_point + 1, 256))]
+        for key, replacement in single_characters.items():
+            char_table[ord(key)] = replacement
+        #
+        return char_table
+
+    @staticmethod
+    def __compile_bytes_table(single_bytes):
+        """Return the arguments for bytes.translate():
+        a translation table and the bytes to delete
+        """
+        byte_table = bytearray(range(256))
+        deletions = bytearray()
+        for key, replacement in single_bytes.items():
+            if replacement:
+                byte_table[key[0]] = replacement[0]
+            else:
+                deletions.append(key[0])
+            #
+        #
+        return bytes(byte_table), bytes(deletions)
+
+    def __as_text(self, text):
+        """Return text, bytes-like objects converted to bytes
+        in bytes mode (as matches are looked up by slices)
+        """
+        if self.bytes_mode and not isinstance(text, bytes):
+            return bytes(text)
+        #
+        return text
+
+    def __count_table_hits(self, text, hits):
+        """Update the hits Counter with the occurrences
+        of the translation table keys in text
+        """
+        for key in self.table_keys:
+            count = text.count(key)
+            if count:
+                hits[key] += count
+            #
+        #
+
+    def translate_part(self, text, limit, pos=0, hits=None):
+        """Translate text from pos up to at least limit.
+        Matches starting at or after limit are left alone,
+        text before pos is only used as context in whole-word mode.
+        Return a tuple of the translated part and the index
+        in text up to which it was consumed.
+        As single characters cannot be part of a longer match,
+        the text between the matches of the multi-character keys
+        is translated using the translation table.
+        If a hits Counter is provided, it is updated with the
+        matched (lookup) keys and the translation table keys
+        found outside of matches. The latter are counted once
+        per call in the joined text between the matches.
+        """
+        text = self.__as_text(text)
+        table_args = self.table_args
+        if self.matcher is None:
+            if table_args is None:
+                return text[pos:], len(text)
+            #
+            if hits is not None:
+                self.__count_table_hits(text[pos:], hits)
+            #
+            return text[pos:].translate(*table_args), len(text)
+        #
+        if self.ignore_case:
+            matchable_text = self.fold(text)
+        else:
+            matchable_text = text
+        #
+        output = []
+        unmatched = None
+        if hits is not None and table_args is not None:
+            unmatched = []
+        #
+        position = pos
+        for start, end in self.matcher.spans(matchable_text, pos):
+            if start >= limit:
+                break
+            #
+            if table_args is None:
+                output.append(text[position:start])
+            else:
+                between = text[position:start]
+                output.append(between.translate(*table_args))
+                if unmatched is not None:
+                    unmatched.append(between)
+                #
+            #
+            if hits is not None:
+                hits[matchable_text[start:end]] += 1
+            #
+            replacement = self.lookup[matchable_text[start:end]]
+            if self.preserve_case:
+                replacement = adapt_case(text[start:end], replacement)
+            #
+            output.append(replacement)
+            position = end
+        #
+        consumed = max(position, limit)
+        if table_args is None:
+            output.append(text[position:consumed])
+        else:
+            between = text[position:consumed]
+            output.append(between.translate(*table_args))
+            if unmatched is not None:
+                unmatched.append(between)
+                self.__count_table_hits(self.empty.join(unmatched), hits)
+            #
+        #
+        return self.empty.join(output), consumed
+
+    def translate(self, text, hits=None):
+        """Translate text and return the result."""
+        return self.translate_part(text, len(text), hits=hits)[0]
+
+    def translate_batch(self, texts, hits=None):
+        """Translate a list of texts and return a list of the results.
+        The texts are joined by a separator and translated at once,
+        unless the separator is contained in any of the texts.
+        """
+        separator = self.separator
+        if separator is not None:
+            joined_hits = None if hits is None else collections.Counter()
+            translated = self.translate(
+                separator.join(texts), hits=joined_hits).split(separator)
+            if len(translated) == len(texts):
+                if hits is not None:
+                    hits.update(joined_hits)
+                #
+                return translated
+            #
+        #
+        return [self.translate(text, hits=hits) for text in texts]
+
+    def translate_iter(self, chunks, hits=None):
+        """Generator translating an iterable of text chunks,
+        yielding translated chunks.
+        A tail of the maximum key length minus one is carried over
+        to the next chunk, so no match is lost at chunk boundaries.
+        In whole-word mode, the tail is one character longer,
+        and the last consumed character is kept as context.
+        """
+        carry = self.empty
+        pos = 0
+        for chunk in chunks:
+            chunk = self.__as_text(chunk)
+            if carry:
+                chunk = carry + chunk
+            #
+            limit = len(chunk) - self.lookahead
+            if limit <= pos:
+                carry = chunk
+                continue
+            #
+            output, consumed = self.translate_part(
+                chunk, limit, pos=pos, hits=hits)
+            pos = self.context
+            carry = chunk[consumed - pos:]
+            if output:
+                yield output
+            #
+        #
+        if len(carry) > pos:
+            yield self.translate_part(
+                carry, len(carry), pos=pos, hits=hits)[0]
+        #
+
+
+class MultiTranslator(abc.MutableMapping):
 
     """All-in-one multiple-string-substitution class
     instantiated like a dict containing (original, replacment) items,
     adapted from <https://www.oreilly.com/library/view
     /python-cookbook/0596001673/ch03s15.html>
     but optimized for re-usability.
+
+    Keys and replacements may be either all str or all bytes
+    (bytes mode, translating bytes-like objects to bytes).
+    Overlapping keys are resolved leftmost-longest.
+    The matching engine can be selected using the keyword-only
+    engine argument (ENGINE_REGEX or ENGINE_AHO_CORASICK).
+    By default, the automaton is used for tables with more than
+    AUTOMATON_THRESHOLD keys.
+
+    Instances are mutable mappings. Each translation uses
+    a consistent snapshot (a CompiledTable) of the replacements.
+    Changes of single-character keys or of replacement values
+    reuse the compiled matcher. If background is True,
+    matchers are recompiled in a background thread, and translations
+    use the previous snapshot until the new one is ready.
+
+    The keyword-only arguments ignore_case, whole_words
+    and preserve_case select the matching modes
+    described in CompiledTable. In case-insensitive mode,
+    keys differing only in case replace each other.
+
+    If collect_stats is True (or after .enable_stats() was called),
+    hits per key, the amount of processed text and a latency histogram
+    are collected, see .stats().
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, engine=None, background=False,
+                 ignore_case=False, whole_words=False, preserve_case=False,
+                 collect_stats=False, **kwargs):
         """Keep an internal dict of (original, replacement) items
-        and precompile a catch-all regular expression
+        and compile it
+        """
+        self.__replacements = {}
+        items = dict(*args, **kwargs)
+        self.__check_items(items)
+        self.__replacements.update(items)
+        self.__engine = engine
+        self.__options = dict(
+            ignore_case=ignore_case,
+            whole_words=whole_words,
+            preserve_case=preserve_case)
+        self.__background = background
+        self.__lock = threading.Lock()
+        self.__generation = 0
+        self.__compiler_thread = None
+        self.__compiled = CompiledTable(
+            dict(self.__replacements), engine=engine, **self.__options)
+        self.__stats_lock = threading.Lock()
+        self.__collect_stats = collect_stats
+        self.reset_stats()
+
+    def __getstate__(self):
+        """Return the replacements and the constructor options
+        for pickling (locks and snapshots cannot be pickled)
+        """
+        with self.__lock:
+            replacements = dict(self.__replacements)
+        #
+        return dict(
+            replacements=replacements,
+            engine=self.__engine,
+            background=self.__background,
+            collect_stats=self.__collect_stats,
+            **self.__options)
+
+    def __setstate__(self, state):
+        """Rebuild the instance from the pickled state,
+        recompiling the snapshot
+        """
+        state = dict(state)
+        self.__init__(state.pop('replacements'), **state)
+
+    @property
+    def bytes_mode(self):
+        """True if the current snapshot translates bytes"""
+        return self.__compiled.bytes_mode
+
+    @property
+    def engine(self):
+        """The matching engine of the current snapshot"""
+        return self.__compiled.engine
+
+    @property
+    def ignore_case(self):
+        """True if keys are matched case-insensitively"""
+        return self.__options['ignore_case']
+
+    @property
+    def whole_words(self):
+        """True if keys only match as whole words"""
+        return self.__options['whole_words']
+
+    @property
+    def preserve_case(self):
+        """True if replacements adapt to the case of the matches"""
+        return self.__options['preserve_case']
+
+    @property
+    def compiled(self):
+        """The current snapshot"""
+        return self.__compiled
+
+    def __check_items(self, items):
+        """Raise a ValueError on empty keys and a TypeError
+        if keys and replacements are not of a common type
+        """
+        text_type = None
+        for key in self.__replacements:
+            text_type = type(key)
+            break
+        #
+        for key, replacement in items.items():
+            if not key:
+                raise ValueError(MSG_EMPTY_KEY)
+            #
+            if text_type is None:
+                text_type = type(key)
+            #
+            if text_type not in (str, bytes) \
+                    or not isinstance(key, text_type) \
+                    or not isinstance(replacement, text_type):
+                raise TypeError(MSG_MIXED_TYPES)
+            #
+        #
+
+    def __recompile(self):
+        """Publish a new snapshot of the replacements.
+        Must be called with the lock held.
+        """
+        self.__generation += 1
+        if self.__compiler_thread is not None:
+            # The running compiler thread will pick up the changes
+            return
+        #
+        if not self.__background:
+            self.__compiled = CompiledTable(
+                dict(self.__replacements),
+                engine=self.__engine,
+                previous=self.__compiled,
+                **self.__options)
+            return
+        #
+        self.__compiler_thread = threading.Thread(
+            target=self.__compile_in_background, daemon=True)
+        self.__compiler_thread.start()
+
+    def __compile_in_background(self):
+        """Compile snapshots until the latest changes are included"""
+        while True:
+            with self.__lock:
+                generation = self.__generation
+                replacements = dict(self.__replacements)
+                current = self.__compiled
+            #
+            compiled = CompiledTable(
+                replacements,
+                engine=self.__engine,
+                previous=current,
+                **self.__options)
+            with self.__lock:
+                self.__compiled = compiled
+                if generation == self.__generation:
+                    self.__compiler_thread = None
+                    return
+                #
+            #
+        #
+
+    @classmethod
+    def load(cls, path, background=False):
+        """Return an instance from a file written by .save(),
+        memory-mapping the file.
+        Raise a ValueError if the file was not written by .save()
+        with the same Python (and marshal format) version.
         """
-        self.__replacements = dict(*args, **kwargs)
-        self.__catch_all = re.compile(
-            '|'.join(re.escape(key) for key in self.__replacements))
+        with open(path, mode='rb') as file_object:
+            try:
+                mapped = mmap.mmap(
+                    file_object.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as error:
+                raise ValueError(MSG_INVALID_FILE.format(path)) from error
+            #
+            with mapped:
+                if mapped[:len(FILE_HEADER)] != FILE_HEADER:
+                    raise ValueError(MSG_INVALID_FILE.format(path))
+                #
+                with memoryview(mapped) as view:
+                    state = marshal.loads(view[len(FILE_HEADER):])
+                #
+            #
+        #
+        compiled = CompiledTable.from_state(state)
+        translator = cls(
+            engine=compiled.engine,
+            background=background,
+            ignore_case=compiled.ignore_case,
+            whole_words=compiled.whole_words,
+            preserve_case=compiled.preserve_case)
+        translator.__replacements.update(compiled.replacements)
+        translator.__compiled = compiled
+        return translator
+
+    def save(self, path):
+        """Save the current snapshot including the compiled matcher
+        (as automaton tables) and translation table to path
+        """
+        with open(path, mode='wb') as file_object:
+            file_object.write(FILE_HEADER)
+            marshal.dump(self.__compiled.state(), file_object)
+        #
+
+    def wait(self):
+        """Wait until a background compilation has finished"""
+        compiler_thread = self.__compiler_thread
+        if compiler_thread is not None:
+            compiler_thread.join()
+        #
+
+    def __getitem__(self, key):
+        """Return the replacement for key"""
+        return self.__replacements[key]
+
+    def __setitem__(self, key, replacement):
+        """Set the replacement for key"""
+        self.update({key: replacement})
+
+    def __delitem__(self, key):
+        """Remove the replacement for key"""
+        with self.__lock:
+            del self.__replacements[key]
+            self.__recompile()
+        #
+
+    def __iter__(self):
+        """Return an iterator over the keys"""
+        return iter(self.__replacements)
+
+    def __len__(self):
+        """Return the number of replacements"""
+        return len(self.__replacements)
+
+    def __repr__(self):
+        """Object representation"""
+        return f'{self.__class__.__name__}({self.__replacements!r})'
+
+    def add(self, key, replacement):
+        """Add a replacement"""
+        self[key] = replacement
+
+    def remove(self, key):
+        """Remove a replacement, raise a KeyError if it does not exist"""
+        del self[key]
+
+    def remove_many(self, keys):
+        """Remove replacements, compiling only once.
+        Raise a KeyError (removing nothing) if any key does not exist.
+        """
+        keys = set(keys)
+        if not keys:
+            return
+        #
+        with self.__lock:
+            for key in keys:
+                if key not in self.__replacements:
+                    raise KeyError(key)
+                #
+            #
+            for key in keys:
+                del self.__replacements[key]
+            #
+            self.__recompile()
+        #
+
+    def clear(self):
+        """Remove all replacements, compiling only once"""
+        with self.__lock:
+            if not self.__replacements:
+                return
+            #
+            self.__replacements.clear()
+            self.__recompile()
+        #
+
+    def update(self, *args, **kwargs):
+        """Add or change replacements, compiling only once"""
+        items = dict(*args, **kwargs)
+        if not items:
+            return
+        #
+        with self.__lock:
+            self.__check_items(items)
+            self.__replacements.update(items)
+            self.__recompile()
+        #
+
+    def enable_stats(self):
+        """Start collecting statistics"""
+        self.__collect_stats = True
+
+    def disable_stats(self):
+        """Stop collecting statistics"""
+        self.__collect_stats = False
+
+    def reset_stats(self):
+        """Reset the collected statistics"""
+        with self.__stats_lock:
+            self.__hits = collections.Counter()
+            self.__calls = 0
+            self.__processed = 0
+            self.__seconds = 0.0
+            self.__latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+        #
+
+    def __record(self, hits, processed, seconds=None):
+        """Add the hits Counter, the processed length
+        and (if given) the latency of a call to the statistics
+        """
+        with self.__stats_lock:
+            self.__hits.update(hits)
+            self.__processed += processed
+            if seconds is not None:
+                self.__calls += 1
+                self.__seconds += seconds
+                self.__latencies[
+                    bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            #
+        #
+
+    def stats(self):
+        """Return a snapshot of the statistics as a dict:
+        calls: number of translation calls,
+        processed: total length of the processed texts
+        (characters, or bytes in bytes mode),
+        seconds: total time spent in the calls,
+        latency_histogram: list of (upper bound in seconds, calls)
+        tuples, the last upper bound being None,
+        hits: dict of the number of replacements per key
+        (0 for dead keys).
+        Calls distributed to worker processes by translate_many()
+        are not timed.
+        """
+        compiled = self.__compiled
+        with self.__stats_lock:
+            counted = collections.Counter(self.__hits)
+            stats = dict(
+                calls=self.__calls,
+                processed=self.__processed,
+                seconds=self.__seconds,
+                latency_histogram=list(
+                    zip(LATENCY_BUCKETS + (None,), self.__latencies)))
+        #
+        hits = {}
+        for key in list(self.__replacements):
+            matchable_key = key
+            if compiled.ignore_case:
+                matchable_key = compiled.fold(key)
+            #
+            count = counted[matchable_key]
+            if compiled.ignore_case and len(matchable_key) == 1 \
+                    and compiled.table_args:
+                # Uppercase variants of table keys are counted separately
+                variant = matchable_key.upper()
+                if variant != matchable_key:
+                    count += counted[variant]
+                #
+            #
+            hits[key] = count
+        #
+        stats['hits'] = hits
+        return stats
 
     def __call__(self, match):
-        """Handler invoked for each regex match"""
-        return self.__replacements[match.group(0)]
+        """Handler for re.sub(): return the replacement
+        for the text of match from the current snapshot,
+        honouring the matching modes
+        """
+        compiled = self.__compiled
+        matched = match.group(0)
+        if compiled.ignore_case:
+            replacement = compiled.lookup[compiled.fold(matched)]
+        else:
+            replacement = compiled.lookup[matched]
+        #
+        if compiled.preserve_case:
+            return adapt_case(matched, replacement)
+        #
+        return replacement
 
     def translate(self, text):
         """Translate text and return the result."""
-        return self.__catch_all.sub(self, text)
+        if not self.__collect_stats:
+            return self.__compiled.translate(text)
+        #
+        hits = collections.Counter()
+        started = time.perf_counter()
+        translated = self.__compiled.translate(text, hits=hits)
+        self.__record(hits, len(text), time.perf_counter() - started)
+        return translated
+
+    def translate_batch(self, texts):
+        """Translate a list of texts and return a list of the results.
+        The texts are joined by a separator and translated at once,
+        unless the separator is contained in any of the texts.
+        """
+        if not self.__collect_stats:
+            return self.__compiled.translate_batch(texts)
+        #
+        hits = collections.Counter()
+        started = time.perf_counter()
+        translated = self.__compiled.translate_batch(texts, hits=hits)
+        self.__record(
+            hits,
+            sum(len(text) for text in texts),
+            time.perf_counter() - started)
+        return translated
+
+    def translate_many(self, texts, workers=None,
+                       chunksize=DEFAULT_BATCH_SIZE):
+        """Generator translating an iterable of texts
+        and yielding the results in order.
+        The texts are translated in batches of chunksize texts.
+        If more than one worker is requested, the batches are
+        distributed to a process pool with the given number of workers,
+        each of which receives the compiled snapshot only once.
+        Texts are read from the iterable only as far as needed
+        to keep two batches per worker in flight.
+        """
+        compiled = self.__compiled
+        batches = _batches(texts, chunksize)
+        if workers is None or workers < 2:
+            for batch in batches:
+                if self.__collect_stats:
+                    yield from self.translate_batch(batch)
+                else:
+                    yield from compiled.translate_batch(batch)
+                #
+            #
+            return
+        #
+        collect_stats = self.__collect_stats
+        # At most two batches per worker are in flight,
+        # so memory use is bounded and the results are streamed
+        window = 2 * workers
+        futures = collections.deque()
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_initialize_worker,
+                initargs=(compiled,)) as executor:
+            try:
+                for batch in batches:
+                    futures.append(executor.submit(
+                        _translate_batch_in_worker, batch, collect_stats))
+                    if len(futures) >= window:
+                        yield from self.__batch_result(futures.popleft())
+                    #
+                #
+                while futures:
+                    yield from self.__batch_result(futures.popleft())
+                #
+            finally:
+                for future in futures:
+                    future.cancel()
+                #
+            #
+        #
+
+    def __batch_result(self, future):
+        """Return the translated batch from the future of a
+        _translate_batch_in_worker() call, recording its statistics
+        """
+        translated, hits, processed = future.result()
+        if hits is not None:
+            self.__record(hits, processed)
+        #
+        return translated
+
+    def translate_iter(self, chunks):
+        """Generator translating an iterable of text chunks,
+        yielding translated chunks.
+        A tail of the maximum key length minus one is carried over
+        to the next chunk, so no match is lost at chunk boundaries.
+        """
+        return self.__translate_chunks(self.__compiled, chunks)
+
+    def __translate_chunks(self, compiled, chunks):
+        """Generator translating an iterable of chunks
+        using the given snapshot, collecting statistics if requested.
+        Each run counts as a single call, timed while translating
+        (including the time spent reading the chunks).
+        """
+        if not self.__collect_stats:
+            yield from compiled.translate_iter(chunks)
+            return
+        #
+        hits = collections.Counter()
+        lengths = []
+
+        def measured(chunks):
+            """Generator yielding chunks and storing their lengths"""
+            for chunk in chunks:
+                lengths.append(len(chunk))
+                yield chunk
+            #
+
+        translated_chunks = compiled.translate_iter(
+            measured(chunks), hits=hits)
+        seconds = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    output = next(translated_chunks)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - started
+                #
+                yield output
+            #
+        finally:
+            self.__record(hits, sum(lengths), seconds)
+        #
+
+    def translate_stream(self, readable, writable,
+                         chunk_size=DEFAULT_CHUNK_SIZE):
+        """Read text from readable in chunks of chunk_size characters
+        (bytes in bytes mode) and write the translation to writable
+        """
+        for output in self.translate_iter(
+                _read_chunks(readable, chunk_size)):
+            writable.write(output)
+        #
+
+    def translate_file(self, path, out_path,
+                       chunk_size=DEFAULT_CHUNK_SIZE, encoding=None):
+        """Translate the file at path and write the result to out_path.
+        In bytes mode, the input file is memory-mapped and translated
+        in slices of chunk_size bytes without decoding,
+        else both files are opened in text mode using encoding,
+        without newline translation.
+        The output is written incrementally in both cases.
+        """
+        compiled = self.__compiled
+        if not compiled.bytes_mode:
+            with open(path, mode='rt', encoding=encoding,
+                      newline='') as readable, \
+                    open(out_path, mode='wt', encoding=encoding,
+                         newline='') as writable:
+                for output in self.__translate_chunks(
+                        compiled, _read_chunks(readable, chunk_size)):
+                    writable.write(output)
+                #
+            #
+            return
+        #
+        with open(path, mode='rb') as readable, \
+                open(out_path, mode='wb') as writable:
+            try:
+                mapped = mmap.mmap(
+                    readable.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                return
+            #
+            with mapped:
+                for output in self.__translate_chunks(
+                        compiled,
+                        (mapped[start:start + chunk_size]
+                         for start in range(0, len(mapped), chunk_size))):
+                    writable.write(output)
+                #
+            #
+        #
+
+
+class TranslatorPipeline:
+
+    """Chain of MultiTranslator stages applied in order.
+
+    If fuse is True, consecutive translators that cannot interact
+    are merged into a single MultiTranslator, so the text is scanned
+    only once for all of them. Two translators cannot interact
+    if they use the same modes (and not whole-word matching),
+    the earlier one never deletes text, and neither its keys
+    nor its replacements share any character with the keys
+    of the later one. Fused stages are built from the current
+    contents and do not follow later changes of their sources.
+
+    translate_iter() and translate_stream() run the stages
+    as a chain of generators, so each chunk passes through
+    all stages before the next one is read.
+    The time spent in each stage is accumulated
+    and returned by stage_timings().
+    """
+
+    def __init__(self, *translators, fuse=True):
+        """Build the stages as a list of
+        (tuple of translator indexes, MultiTranslator) tuples
+        """
+        self.stages = []
+        group = []
+        for index, translator in enumerate(translators):
+            if group and fuse and all(
+                    self.__independent(earlier, translator)
+                    for _, earlier in group):
+                group.append((index, translator))
+                continue
+            #
+            self.__add_stage(group)
+            group = [(index, translator)]
+        #
+        self.__add_stage(group)
+        self.__timings = [0.0] * len(self.stages)
+
+    def __add_stage(self, group):
+        """Add a stage from a group of (index, translator) tuples"""
+        if not group:
+            return
+        #
+        indexes = tuple(index for index, _ in group)
+        if len(group) == 1:
+            self.stages.append((indexes, group[0][1]))
+            return
+        #
+        first_translator = group[0][1]
+        replacements = {}
+        for _, translator in group:
+            replacements.update(translator)
+        #
+        self.stages.append(
+            (indexes,
+             MultiTranslator(
+                 replacements,
+                 ignore_case=first_translator.ignore_case,
+                 preserve_case=first_translator.preserve_case)))
+
+    @staticmethod
+    def __independent(earlier, later):
+        """Return True if translating with earlier and then with later
+        has the same result as translating with both at once
+        """
+        if earlier.whole_words or later.whole_words \
+                or earlier.ignore_case != later.ignore_case \
+                or earlier.preserve_case != later.preserve_case \
+                or (earlier and later
+                    and earlier.bytes_mode != later.bytes_mode):
+            return False
+        #
+        if not all(earlier.values()):
+            return False
+        #
+        fold = later.compiled.fold
+        later_characters = set()
+        for key in later.compiled.lookup:
+            later_characters.update(key)
+        #
+        for text in itertools.chain(earlier, earlier.values()):
+            if later.ignore_case:
+                text = fold(text)
+            #
+            if not later_characters.isdisjoint(text):
+                return False
+            #
+        #
+        return True
+
+    def stage_timings(self):
+        """Return a list of (tuple of translator indexes, seconds)
+        tuples containing the accumulated time spent in each stage
+        """
+        return [
+            (indexes, seconds)
+            for (indexes, _), seconds in zip(self.stages, self.__timings)]
+
+    def reset_timings(self):
+        """Reset the accumulated stage timings"""
+        self.__timings = [0.0] * len(self.stages)
+
+    def translate(self, text):
+        """Translate text through all stages and return the result."""
+        for index, (_, translator) in enumerate(self.stages):
+            started = time.perf_counter()
+            text = translator.translate(text)
+            self.__timings[index] += time.perf_counter() - started
+        #
+        return text
+
+    @staticmethod
+    def __timed(iterator, inclusive_timings, index):
+        """Generator yielding from iterator, adding the time spent
+        in it (including the preceding stages) to
+        inclusive_timings[index]
+        """
+        iterator = iter(iterator)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                inclusive_timings[index] += time.perf_counter() - started
+                return
+            #
+            inclusive_timings[index] += time.perf_counter() - started
+            yield item
+        #
+
+    def translate_iter(self, chunks):
+        """Generator translating an iterable of text chunks
+        through the chained stages, yielding translated chunks
+        """
+        inclusive_timings = [0.0] * (len(self.stages) + 1)
+        chained = self.__timed(chunks, inclusive_timings, 0)
+        for index, (_, translator) in enumerate(self.stages, start=1):
+            chained = self.__timed(
+                translator.translate_iter(chained), inclusive_timings, index)
+        #
+        try:
+            yield from chained
+        finally:
+            for index in range(len(self.stages)):
+                self.__timings[index] += (
+                    inclusive_timings[index + 1] - inclusive_timings[index])
+            #
+        #
+
+    def translate_stream(self, readable, writable,
+                         chunk_size=DEFAULT_CHUNK_SIZE):
+        """Read text from readable in chunks of chunk_size characters
+        and write the translation through all stages to writable
+        """
+        for output in self.translate_iter(
+                _read_chunks(readable, chunk_size)):
+            writable.write(output)
+        #
+
+
+#
+# Benchmarks
+#
+
+
+def _random_words(number, min_length=3, max_length=10, seed=0):
+    """Return a list of number distinct random lowercase words"""
+    randomizer = random.Random(seed)
+    words = set()
+    while len(words) < number:
+        words.add(
+            ''.join(
+                randomizer.choice(string.ascii_lowercase)
+                for _ in range(randomizer.randint(min_length, max_length))))
+    #
+    return sorted(words)
+
+
+def _benchmark_engines(key_counts=(10, 1000, 50000), text_words=20000):
+    """Compare compile and translation times of the engines"""
+    for key_count in key_counts:
+        keys = _random_words(key_count)
+        replacements = {key: key.upper() for key in keys}
+        text = ' '.join(_random_words(text_words, seed=1)[:text_words // 2]
+                        + keys[:text_words // 2])
+        for engine in (ENGINE_REGEX, ENGINE_AHO_CORASICK):
+            compile_time = timeit.timeit(
+                lambda engine=engine: MultiTranslator(
+                    replacements, engine=engine),
+                number=1)
+            translator = MultiTranslator(replacements, engine=engine)
+            translate_time = timeit.timeit(
+                lambda translator=translator: translator.translate(text),
+                number=1)
+            print(f'{key_count:>6} keys, {engine:<12}:'
+                  f' compile {compile_time:8.4f} s,'
+                  f' translate {translate_time:8.4f} s'
+                  f' ({len(text)} characters)')
+        #
+    #
+
+
+def _benchmark_single_characters(text_length=1000000):
+    """Compare a regex substitution with a callback
+    and the translation table for single-character keys
+    """
+    replacements = {
+        '\xc4': 'Ae', '\xd6': 'Oe', '\xdc': 'Ue',
+        '\xe4': 'ae', '\xf6': 'oe', '\xfc': 'ue', '\xdf': 'ss',
+        '.': '', ',': '', ';': '', '!': '', '?': ''}
+    randomizer = random.Random(0)
+    text = ''.join(
+        randomizer.choice(string.ascii_letters + ' ' + ''.join(replacements))
+        for _ in range(text_length))
+    catch_all = re.compile('|'.join(re.escape(key) for key in replacements))
+    callback_time = timeit.timeit(
+        lambda: catch_all.sub(
+            lambda match: replacements[match.group(0)], text),
+        number=3) / 3
+    translator = MultiTranslator(replacements)
+    table_time = timeit.timeit(
+        lambda: translator.translate(text), number=3) / 3
+    print(f'{len(replacements)} single characters:'
+          f' regex callback {callback_time:8.4f} s,'
+          f' translation table {table_time:8.4f} s'
+          f' ({len(text)} characters)')
+
+
+def _benchmark_startup(key_count=50000):
+    """Compare compiling a translator and loading a saved one"""
+    replacements = {
+        key: key.upper() for key in _random_words(key_count)}
+    for engine in (ENGINE_REGEX, ENGINE_AHO_CORASICK):
+        compile_time = timeit.timeit(
+            lambda engine=engine: MultiTranslator(
+                replacements, engine=engine),
+            number=1)
+        print(f'{key_count:>6} keys, {engine:<12}:'
+              f' compile {compile_time:8.4f} s')
+    #
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'translator.bin')
+        MultiTranslator(replacements).save(path)
+        load_time = timeit.timeit(
+            lambda: MultiTranslator.load(path), number=1)
+        print(f'{key_count:>6} keys, saved       :'
+              f' load    {load_time:8.4f} s'
+              f' ({os.stat(path).st_size} bytes)')
+    #
+
+
+if __name__ == '__main__':
+    _benchmark_engines()
+    _benchmark_single_characters()
+    _benchmark_startup()
 
 
 # vim: fileencoding=utf-8 sw=4 ts=4 sts=4 expandtab autoindent syntax=python: